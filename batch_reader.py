@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import threading
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger()
+
+MIN_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 500000
+# an arrow batch and its pandas copy are alive at the same time while converting
+PANDAS_CONVERSION_FACTOR = 2
+
+
+def get_memory_budget(fraction=0.5):
+    """Bytes of memory available for data batches, based on the Lambda's configured memory."""
+    memory_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if memory_mb is not None:
+        total = int(memory_mb) * 1024 * 1024
+    else:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    return int(total * fraction)
+
+
+def estimate_row_bytes(parquet_file, columns=None):
+    metadata = parquet_file.metadata
+    if metadata.num_rows == 0:
+        return 1
+    columns = set(columns) if columns is not None else None
+    total = 0
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for col in range(row_group.num_columns):
+            column = row_group.column(col)
+            if columns is None or column.path_in_schema in columns:
+                total += column.total_uncompressed_size
+    return max(1, total // metadata.num_rows)
+
+
+def choose_batch_size(parquet_file, columns=None, memory_budget=None, batches_in_flight=4):
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    row_bytes = estimate_row_bytes(parquet_file, columns) * PANDAS_CONVERSION_FACTOR
+    batch_size = memory_budget // (row_bytes * batches_in_flight)
+    return int(min(MAX_BATCH_SIZE, max(MIN_BATCH_SIZE, batch_size)))
+
+
+def stream_row_groups(parquet_file, columns=None, memory_budget=None):
+    """
+    Yield pandas DataFrames covering a parquet file at row group granularity,
+    with every frame's decoded size kept under memory_budget.
+
+    Consecutive row groups are read together while they fit the budget, and a
+    row group that is larger than the budget on its own is split into batches.
+    """
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    metadata = parquet_file.metadata
+    row_bytes = estimate_row_bytes(parquet_file, columns) * PANDAS_CONVERSION_FACTOR
+
+    pending = []
+    pending_bytes = 0
+    for rg in range(metadata.num_row_groups):
+        rg_bytes = metadata.row_group(rg).num_rows * row_bytes
+        if pending and pending_bytes + rg_bytes > memory_budget:
+            yield parquet_file.read_row_groups(pending, columns=columns, use_pandas_metadata=True).to_pandas()
+            pending = []
+            pending_bytes = 0
+
+        if rg_bytes > memory_budget:
+            batch_size = choose_batch_size(parquet_file, columns, memory_budget, batches_in_flight=1)
+            for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=[rg], columns=columns,
+                                                   use_pandas_metadata=True):
+                yield batch.to_pandas()
+        else:
+            pending.append(rg)
+            pending_bytes += rg_bytes
+
+    if pending:
+        yield parquet_file.read_row_groups(pending, columns=columns, use_pandas_metadata=True).to_pandas()
+
+
+def read_columns(path, columns=None, memory_budget=None, batches_in_budget=4):
+    """
+    Read columns of a whole parquet file into one DataFrame by row group, so
+    only one batch's arrow table is alive next to the frames decoded so far
+    instead of the arrow table of the whole file.
+    """
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    parquet_file = pq.ParquetFile(path)
+    frames = list(stream_row_groups(parquet_file, columns, memory_budget // batches_in_budget))
+    if not frames:
+        return parquet_file.read(columns=columns, use_pandas_metadata=True).to_pandas()
+    return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+
+def prefetch_batches(path, columns=None, batch_size=None, queue_size=2, memory_budget=None, held_batches=1):
+    """
+    Yield pandas DataFrames from a parquet file while the next batches are decoded
+    on a background thread, so decoding overlaps with whatever the caller does
+    with the current batch (usually model.predict).
+
+    At most queue_size decoded batches wait in the queue. When batch_size is not
+    given the file is streamed by row group, sized so that the queued batches,
+    the one being decoded and the held_batches batch sized frames the caller
+    keeps alive at once (e.g. staged_predict's chunks in flight and their
+    pre_predict outputs) fit in memory_budget.
+    """
+    parquet_file = pq.ParquetFile(path)
+    if batch_size is None:
+        if memory_budget is None:
+            memory_budget = get_memory_budget()
+        batches_in_flight = queue_size + 1 + held_batches
+        source = stream_row_groups(parquet_file, columns, memory_budget // batches_in_flight)
+        logger.info(f'Reading {path} by row group with a {memory_budget // batches_in_flight} byte budget per batch')
+    else:
+        source = (batch.to_pandas() for batch in
+                  parquet_file.iter_batches(batch_size=batch_size, columns=columns, use_pandas_metadata=True))
+        logger.info(f'Reading {path} in batches of {batch_size} rows')
+
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # give up if the consumer went away instead of blocking forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for batch_df in source:
+                if not put(batch_df):
+                    return
+            put(done)
+        except BaseException as ex:
+            put(ex)
+
+    producer = threading.Thread(target=produce, name='parquet-prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
@@ -0,0 +1,260 @@
+"""
+Offline benchmark for lambda_handler's submission and diagnostics paths.
+
+Generates synthetic v4 shaped live and validation parquet files, swaps NumerAPI,
+S3, STS, Secrets Manager and the upload PUT for local stand-ins, runs the
+handler for every requested data size and reports wall time, rows/s and the
+per stage duration and peak RSS recorded by the handler's metrics spans.
+
+    python benchmarks/bench_handler.py --rows 5000,50000 --features 500
+"""
+import argparse
+import collections
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+from botocore.exceptions import ClientError
+import pandas as pd
+from ncl import aws_clients
+import lambda_handler
+import model_pipeline
+import prediction_writer
+import dataset_cache
+from dataset_cache import DatasetCache
+from metrics import Metrics
+
+
+AWS_ACCOUNT_ID = '000000000000'
+CURRENT_ROUND = 500
+
+
+class LinearModel:
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def predict(self, data):
+        return data.to_numpy(dtype=np.float32) @ self.weights
+
+
+def make_dataset(path, num_rows, features, num_eras, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.integers(0, 5, (num_rows, len(features)), dtype=np.int8), columns=features)
+    data['era'] = np.repeat(np.arange(num_eras), int(np.ceil(num_rows / num_eras)))[:num_rows].astype(str)
+    data['data_type'] = 'validation'
+    data['target'] = rng.random(num_rows, dtype=np.float32)
+    data.index = pd.Index([f'n{i:015x}' for i in range(num_rows)], name='id')
+    data.to_parquet(path)
+
+
+class LocalNumerAPI:
+    """Serves datasets from a local directory and records uploads and queries."""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.queries = []
+
+    def get_current_round(self):
+        return CURRENT_ROUND
+
+    def raw_query(self, query, variables=None, authorization=False, **kwargs):
+        self.queries.append(variables)
+        return {'data': {
+            'dataset': os.path.join(self.data_dir, (variables or {}).get('filename', '')),
+            'create_submission': {'id': 'submission'},
+            'createDiagnostics': {'id': 'diagnostics'},
+        }}
+
+    def _upload_auth(self, endpoint, file_path, tournament, model_id):
+        return {'filename': os.path.basename(file_path), 'url': 'http://localhost/upload'}
+
+
+class LocalS3:
+    """The subset of the S3 client the handler uses, backed by a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def head_object(self, Bucket, Key):
+        stat = os.stat(os.path.join(self.root, Bucket, Key))
+        return {'ETag': f'"{stat.st_mtime_ns}-{stat.st_size}"', 'ContentLength': stat.st_size}
+
+    def get_object(self, Bucket, Key):
+        path = os.path.join(self.root, Bucket, Key)
+        if not os.path.exists(path):
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        with open(path, 'rb') as f:
+            return dict(self.head_object(Bucket, Key), Body=io.BytesIO(f.read()))
+
+    def download_file(self, Bucket, Key, Filename):
+        path = os.path.join(self.root, Bucket, Key)
+        if not os.path.exists(path):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        shutil.copyfile(path, Filename)
+
+
+class LocalBoto3:
+    """Stands in for the boto3 session aws_clients creates its clients from."""
+
+    def __init__(self, s3_root):
+        self.clients = {
+            's3': LocalS3(s3_root),
+            'sts': types.SimpleNamespace(get_caller_identity=lambda: {'Account': AWS_ACCOUNT_ID}),
+            'secretsmanager': types.SimpleNamespace(get_secret_value=lambda SecretId: {
+                'SecretString': json.dumps({'public_id': 'local', 'secret_key': 'local'})}),
+        }
+
+    def client(self, service_name, **kwargs):
+        return self.clients[service_name]
+
+
+class LocalResponse:
+
+    def __init__(self, path):
+        self.path = path
+        self.headers = {'content-length': str(os.path.getsize(path))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+
+class LocalRequests:
+    """Serves dataset urls, which are local paths here, and counts uploaded bytes."""
+
+    def __init__(self):
+        self.uploaded_bytes = 0
+
+    def get(self, url, stream=False, timeout=None):
+        return LocalResponse(url)
+
+    def put(self, url, data=None, headers=None, timeout=None):
+        self.uploaded_bytes += len(data.read())
+        return types.SimpleNamespace(raise_for_status=lambda: None)
+
+
+def setup_model(s3_root, model_id, features, model_type='linear', seed=0):
+    model_dir = os.path.join(s3_root, f'numerai-compute-{AWS_ACCOUNT_ID}', model_id)
+    os.makedirs(model_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    if model_type in ['lightgbm', 'ensemble']:
+        import lightgbm as lgb
+        train = pd.DataFrame(rng.integers(0, 5, (5000, len(features)), dtype=np.int8), columns=features)
+        members = [
+            lgb.LGBMRegressor(n_estimators=200, num_leaves=31, seed=member, verbose=-1).fit(train, rng.random(len(train)))
+            for member in range(3 if model_type == 'ensemble' else 1)
+        ]
+        model = members[0] if model_type == 'lightgbm' else model_pipeline.EnsembleModel(members, [0.5, 0.3, 0.2])
+        # saved the way DefaultPipeline would, with a manifest next to the native model file
+        orig_dir = os.getcwd()
+        try:
+            os.chdir(model_dir)
+            model_pipeline.DefaultPipeline(model_id).pickle(model)
+        finally:
+            os.chdir(orig_dir)
+    else:
+        weights = rng.standard_normal(len(features)).astype(np.float32)
+        pd.to_pickle(LinearModel(weights), os.path.join(model_dir, 'model.pkl'))
+    with open(os.path.join(model_dir, 'features.json'), 'w') as f:
+        json.dump(features, f)
+
+
+def install_stand_ins(work_dir, napi):
+    aws_clients.reset(LocalBoto3(os.path.join(work_dir, 's3')))
+    lambda_handler.numerapi = types.SimpleNamespace(NumerAPI=lambda **kwargs: napi)
+    prediction_writer.requests = dataset_cache.requests = LocalRequests()
+
+
+def reset_caches(work_dir):
+    lambda_handler.model_cache.clear()
+    shutil.rmtree(os.path.join(work_dir, 'cache'), ignore_errors=True)
+    lambda_handler.dataset_cache = DatasetCache(os.path.join(work_dir, 'cache'))
+
+
+def run_case(work_dir, invocation_type, model_ids, metrics_path):
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    lambda_handler.metrics = Metrics(file_path=metrics_path, stream=io.StringIO())
+    context = types.SimpleNamespace(aws_request_id='benchmark', log_stream_name='benchmark',
+                                    function_name='benchmark')
+    event = {'model_ids': model_ids, 'data_version': 'v4', 'invocation_type': invocation_type}
+
+    start = time.perf_counter()
+    succeeded = lambda_handler.run(event, context)
+    wall_time = time.perf_counter() - start
+    if not succeeded:
+        raise RuntimeError(f'{invocation_type} run failed, see the log above')
+
+    stages = collections.OrderedDict()
+    with open(metrics_path) as f:
+        for line in f:
+            record = json.loads(line)
+            stage = stages.setdefault(record['Stage'], {'duration_ms': 0.0, 'peak_rss_mb': 0.0})
+            stage['duration_ms'] += record['Duration']
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], record['PeakRSS'])
+    return wall_time, stages
+
+
+def report(invocation_type, num_rows, num_models, wall_time, stages):
+    print(f'{invocation_type}: {num_rows} rows x {num_models} model(s): '
+          f'{wall_time:.2f} s, {num_rows * num_models / wall_time:,.0f} rows/s')
+    for stage, values in stages.items():
+        print(f'    {stage:<16} {values["duration_ms"]:10.1f} ms   peak {values["peak_rss_mb"]:8.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='5000,50000', help='comma separated row counts to benchmark')
+    parser.add_argument('--features', type=int, default=500)
+    parser.add_argument('--eras', type=int, default=20)
+    parser.add_argument('--model', choices=['linear', 'lightgbm', 'ensemble'], default='linear')
+    parser.add_argument('--models', type=int, default=1, help='models per invocation')
+    parser.add_argument('--invocation-types', default='submission,diagnostics')
+    parser.add_argument('--warm', action='store_true', help='keep the model and dataset caches between runs')
+    args = parser.parse_args()
+
+    features = [f'feature_{i}' for i in range(args.features)]
+    model_ids = [f'benchmark-model-{i}' for i in range(args.models)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_dir = os.path.join(work_dir, 'data')
+        os.makedirs(os.path.join(data_dir, 'v4'))
+        napi = LocalNumerAPI(data_dir)
+        install_stand_ins(work_dir, napi)
+        for i, model_id in enumerate(model_ids):
+            setup_model(os.path.join(work_dir, 's3'), model_id, features, args.model, seed=i)
+        metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+
+        for num_rows in [int(rows) for rows in args.rows.split(',')]:
+            for invocation_type in args.invocation_types.split(','):
+                data_type = 'live' if invocation_type == 'submission' else 'validation'
+                make_dataset(os.path.join(data_dir, 'v4', f'{data_type}.parquet'), num_rows, features, args.eras)
+                reset_caches(work_dir)
+                if args.warm:
+                    # one untimed run to fill the caches
+                    run_case(work_dir, invocation_type, model_ids, metrics_path)
+                wall_time, stages = run_case(work_dir, invocation_type, model_ids, metrics_path)
+                report(invocation_type, num_rows, len(model_ids), wall_time, stages)
+
+
+if __name__ == '__main__':
+    main()
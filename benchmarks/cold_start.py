@@ -0,0 +1,104 @@
+"""
+Measure how long importing lambda_handler takes in a fresh interpreter, and how
+long it takes until every module the first invocation needs is loaded.
+
+Each sample runs in its own subprocess so nothing is shared between runs, which
+is what a Lambda cold start looks like. No AWS credentials are needed since the
+handler defers the Secrets Manager call and boto3 clients to the first invocation.
+
+    python benchmarks/cold_start.py --runs 10 --budget-ms 200
+"""
+import argparse
+import collections
+import os
+import statistics
+import subprocess
+import sys
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import lambda_handler
+print(time.perf_counter() - start)
+'''
+
+# touching an attribute of every lazy module forces the imports a first
+# invocation pays for, without making any network calls
+FIRST_INVOCATION_SCRIPT = '''
+import time
+start = time.perf_counter()
+import lambda_handler
+lambda_handler.aws_clients.get_session()
+for module in [lambda_handler.np, lambda_handler.pd, lambda_handler.pq, lambda_handler.botocore_exceptions,
+               lambda_handler.numerapi, lambda_handler.model_pipeline,
+               lambda_handler.batch_reader, lambda_handler.prediction_writer,
+               lambda_handler.staged_predict]:
+    module.__name__
+print(time.perf_counter() - start)
+'''
+
+
+def time_script(script, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=REPO_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        samples.append(float(output.stdout.strip().splitlines()[-1]) * 1000)
+    return samples
+
+
+def slowest_packages(count):
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', FIRST_INVOCATION_SCRIPT],
+        cwd=REPO_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # sum the self time of every module per top level package, which stays
+    # correct however deeply the package was imported
+    timings = collections.Counter()
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        timings[name.strip().split('.')[0]] += int(self_us)
+    return timings.most_common(count)
+
+
+def report(label, samples):
+    print(f'{label}: median {statistics.median(samples):.1f} ms, '
+          f'min {min(samples):.1f} ms, max {max(samples):.1f} ms over {len(samples)} runs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='fail if the median handler import time exceeds this budget')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest packages to list')
+    args = parser.parse_args()
+
+    import_samples = time_script(IMPORT_SCRIPT, args.runs)
+    report('import lambda_handler', import_samples)
+    report('first invocation imports', time_script(FIRST_INVOCATION_SCRIPT, args.runs))
+
+    print('slowest packages:')
+    for name, self_us in slowest_packages(args.top):
+        print(f'  {self_us / 1000:8.1f} ms  {name}')
+
+    if args.budget_ms is not None and statistics.median(import_samples) > args.budget_ms:
+        print(f'import time over budget of {args.budget_ms} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import logging
+import math
+import os
+
+
+logger = logging.getLogger()
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Lambda allocates one vCPU worth of CPU time per 1769 MB of configured memory
+LAMBDA_MB_PER_VCPU = 1769
+# variables read once by OpenMP and the BLAS libraries when they are loaded
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+
+def read_cgroup_quota(cgroup_root=CGROUP_ROOT):
+    """CPUs worth of time the cgroup may use per period, or None when unlimited or unknown."""
+    try:
+        # cgroup v2: "<quota> <period>", quota is "max" when unlimited
+        with open(os.path.join(cgroup_root, 'cpu.max')) as f:
+            quota, period = f.read().split()[:2]
+        if quota == 'max':
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    for cpu_dir in ['cpu', 'cpu,cpuacct']:
+        try:
+            # cgroup v1: a quota of -1 means unlimited
+            with open(os.path.join(cgroup_root, cpu_dir, 'cpu.cfs_quota_us')) as f:
+                quota = int(f.read())
+            with open(os.path.join(cgroup_root, cpu_dir, 'cpu.cfs_period_us')) as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            continue
+        if quota <= 0 or period <= 0:
+            return None
+        return quota / period
+    return None
+
+
+def read_lambda_quota():
+    memory_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if memory_mb is None:
+        return None
+    return int(memory_mb) / LAMBDA_MB_PER_VCPU
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_cpu_quota(cgroup_root=CGROUP_ROOT):
+    """
+    Returns (num_threads, source): how many threads inference should use and
+    where that number came from. The cgroup CPU quota wins, then the Lambda
+    memory size, and both are capped by the CPUs the process may run on.
+    """
+    cpus = available_cpus()
+    for source, quota in [('cgroup', read_cgroup_quota(cgroup_root)), ('lambda memory', read_lambda_quota())]:
+        if quota is not None:
+            return max(1, min(cpus, math.ceil(quota))), source
+    return cpus, 'cpu affinity'
+
+
+def set_thread_env(num_threads):
+    # only effective before numpy, lightgbm etc. are imported, explicit settings are kept
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(num_threads))
+
+
+def limit_thread_pools(num_threads):
+    """Limit the OpenMP and BLAS pools of every native library loaded so far."""
+    try:
+        import threadpoolctl
+    except ImportError:
+        return []
+    threadpoolctl.threadpool_limits(limits=num_threads)
+    return [(pool['internal_api'], pool['num_threads']) for pool in threadpoolctl.threadpool_info()]
+
+
+class LightGBMThreads:
+    """Passes num_threads to every predict call of a LightGBM model."""
+
+    def __init__(self, model, num_threads):
+        self.model = model
+        self.num_threads = num_threads
+
+    def predict(self, data, **kwargs):
+        return self.model.predict(data, num_threads=self.num_threads, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.model, attr)
+
+
+def limit_model_threads(model, num_threads):
+    """
+    Returns model set up to predict with num_threads threads. An ensemble
+    predicts its members in parallel, so the threads are split between them
+    instead of every member starting a full sized pool.
+    """
+    from model_pipeline import EnsembleModel
+    if isinstance(model, EnsembleModel):
+        member_threads = max(1, num_threads // len(model.models))
+        return EnsembleModel([limit_model_threads(m, member_threads) for m in model.models], model.weights)
+    if type(model).__module__.startswith('lightgbm'):
+        return LightGBMThreads(model, num_threads)
+    return model
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import requests
+
+
+logger = logging.getLogger()
+
+# leave some of the ephemeral storage for the model pickle, features.json
+# and the prediction files written next to the cached datasets
+DEFAULT_STORAGE_FRACTION = 0.75
+HASH_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 600
+# the query NumerAPI.download_dataset uses to look up the signed dataset url
+DATASET_URL_QUERY = '''
+    query ($filename: String!
+           $round: Int) {
+        dataset(filename: $filename
+                round: $round)
+    }
+'''
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# Keeps downloaded datasets in /tmp between invocations of a warm container.
+# Entries are keyed by data version, file name and round so a new round always
+# triggers a fresh download, and the least recently used entries are evicted to
+# stay below the ephemeral storage limit.
+class DatasetCache:
+
+    manifest_filename = 'manifest.json'
+
+    def __init__(self, cache_dir='/tmp/datasets', max_bytes=None, verify_hash=False):
+        self.cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self.verify_hash = verify_hash
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            total = shutil.disk_usage(self.cache_dir).total
+            self._max_bytes = int(total * DEFAULT_STORAGE_FRACTION)
+        return self._max_bytes
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.cache_dir, self.manifest_filename)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def cache_key(data_version, filename, round_num):
+        return f'{data_version}/{filename}@{round_num}'
+
+    def local_path(self, data_version, filename, round_num):
+        return os.path.join(self.cache_dir, data_version, str(round_num), filename)
+
+    def is_valid(self, entry):
+        path = entry['path']
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        if self.verify_hash and (entry.get('sha256') is None or file_sha256(path) != entry['sha256']):
+            return False
+        return True
+
+    def get(self, napi, data_version, filename, round_num):
+        """Return a local path for the dataset, downloading it only on a cache miss."""
+        manifest = self.load_manifest()
+        key = self.cache_key(data_version, filename, round_num)
+
+        entry = manifest.get(key)
+        if entry is not None and self.is_valid(entry):
+            logger.info(f'Dataset cache hit for {key}')
+            entry['last_used'] = time.time()
+            self.save_manifest(manifest)
+            return entry['path']
+
+        if entry is not None:
+            logger.info(f'Cached dataset {key} failed validation, downloading again')
+            self.remove(manifest, key)
+
+        # older rounds of the same file are never read again
+        for stale_key in [k for k in manifest if k.startswith(f'{data_version}/{filename}@')]:
+            self.remove(manifest, stale_key)
+        self.save_manifest(manifest)
+
+        path = self.local_path(data_version, filename, round_num)
+        partial_path = f'{path}.part'
+        size, sha256 = self.download(napi, f'{data_version}/{filename}', partial_path, round_num)
+        os.replace(partial_path, path)
+
+        manifest[key] = {
+            'path': path,
+            'size': size,
+            'sha256': sha256,
+            'last_used': time.time(),
+        }
+        self.evict(manifest, keep=key)
+        self.save_manifest(manifest)
+        return path
+
+    def download(self, napi, filename, dest_path, round_num):
+        """
+        Stream a dataset to dest_path and return (size, sha256). The size is
+        checked against the Content-Length of the response so a truncated
+        download never enters the cache, and the hash is only computed, from
+        the downloaded chunks, when verify_hash is set.
+        """
+        url = napi.raw_query(DATASET_URL_QUERY, {'filename': filename, 'round': round_num})['data']['dataset']
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        sha256 = hashlib.sha256() if self.verify_hash else None
+        size = 0
+        with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            remote_size = response.headers.get('content-length')
+            with open(dest_path, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if sha256 is not None:
+                        sha256.update(chunk)
+        if remote_size is not None and size != int(remote_size):
+            os.remove(dest_path)
+            raise IOError(f'Downloaded {size} bytes of {filename}, expected {remote_size}')
+        return size, sha256.hexdigest() if sha256 is not None else None
+
+    def evict(self, manifest, keep=None):
+        total = sum(entry['size'] for entry in manifest.values())
+        by_last_used = sorted(manifest.items(), key=lambda item: item[1]['last_used'])
+        for key, entry in by_last_used:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry['size']
+            self.remove(manifest, key)
+
+    def remove(self, manifest, key):
+        entry = manifest.pop(key)
+        try:
+            os.remove(entry['path'])
+        except FileNotFoundError:
+            pass
+        logger.info(f'Evicted {key} from dataset cache')
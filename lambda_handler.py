@@ -1,33 +1,109 @@
-import pandas as pd
-from numerapi import NumerAPI
-import boto3
+import collections
+import importlib
 import json
 import gc
 import logging
-import math
-from time import sleep
+import os
+import threading
+import time
 import sys
 import traceback
-from pyarrow.parquet import ParquetFile
-import pyarrow.parquet as pq
-from model_pipeline import DefaultPipeline
+from concurrent.futures import ThreadPoolExecutor
+from ncl import aws_clients
+import cpu_quota
+from dataset_cache import DatasetCache
+from status_reporter import StatusReporter
+from metrics import Metrics
 
 
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access, so
+    importing the handler stays cheap and never needs AWS credentials.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# thread pools are sized to the CPU quota the container actually gets rather than
+# the host's cores, the environment has to be set before numpy and lightgbm load
+num_threads, num_threads_source = cpu_quota.get_cpu_quota()
+cpu_quota.set_thread_env(num_threads)
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+pq = LazyModule('pyarrow.parquet')
+botocore_exceptions = LazyModule('botocore.exceptions')
+numerapi = LazyModule('numerapi')
+model_pipeline = LazyModule('model_pipeline')
+batch_reader = LazyModule('batch_reader')
+prediction_writer = LazyModule('prediction_writer')
+staged_predict = LazyModule('staged_predict')
+
+
+ID_COL = 'id'
+ERA_COL = 'era'
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-secretsmanager = boto3.client('secretsmanager')
-api_keys_secret = secretsmanager.get_secret_value(SecretId='numerai-api-keys')
-secret = json.loads(api_keys_secret['SecretString'])
+SECRET_ID = 'numerai-api-keys'
+SECRET_TTL_SECONDS = 15 * 60
+STATUS_FLUSH_TIMEOUT_SECONDS = 30
+# share of the Lambda's memory that unpickled models kept by a warm container may
+# use, measured by the size of their artifacts, see cache_model
+MODEL_CACHE_MEMORY_FRACTION = float(os.environ.get('NUMERAI_COMPUTE_MODEL_CACHE_FRACTION', 0.25))
+# features files fetched at once when an invocation runs several models
+FEATURES_DOWNLOAD_WORKERS = 8
+# neutralize's float32 copy of an exposure, and the predictions, era codes and
+# sort order it keeps for every row, see check_post_predict_memory
+NEUTRALIZE_BYTES_PER_EXPOSURE = 4
+POST_PREDICT_BYTES_PER_ROW = 32
+
+# module level state survives between invocations of a warm container
+secret = None
+secret_expires_at = 0
+model_cache = collections.OrderedDict()
+model_cache_lock = threading.Lock()
+# bumped by every invocation, models used by the current one are never evicted
+model_cache_generation = 0
+dataset_cache = DatasetCache()
+metrics = Metrics(dimensions={'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')})
+
+
+def get_secret():
+    # refreshed after the TTL so rotated api keys are picked up by warm containers
+    global secret, secret_expires_at
+    if secret is None or time.monotonic() >= secret_expires_at:
+        api_keys_secret = aws_clients.get_client('secretsmanager').get_secret_value(SecretId=SECRET_ID)
+        secret = json.loads(api_keys_secret['SecretString'])
+        secret_expires_at = time.monotonic() + SECRET_TTL_SECONDS
+    return secret
 
 
 def run(event, context):
-    napi = NumerAPI(
-        public_id=secret['public_id'],
-        secret_key=secret['secret_key']
+    global model_cache_generation
+    model_cache_generation += 1
+
+    api_keys = get_secret()
+    napi = numerapi.NumerAPI(
+        public_id=api_keys['public_id'],
+        secret_key=api_keys['secret_key']
     )
 
-    model_id = event['model_id']
+    # a single invocation can run several models that share one live data load
+    if 'model_ids' in event:
+        model_ids = event['model_ids']
+    else:
+        model_ids = [event['model_id']]
+
     if 'data_version' in event:
         data_version = event['data_version']
     else:
@@ -38,57 +114,135 @@ def run(event, context):
     else:
         invocation_type = 'submission'
 
-    request_id = context.aws_request_id
-    log_stream_name = context.log_stream_name
-    set_lambda_status(context.function_name, model_id, request_id, "in_progress", napi, log_stream_name)
+    # statuses are sent from a background thread, batched across models
+    status_reporter = StatusReporter(napi, context.function_name, context.aws_request_id, context.log_stream_name)
+    for model_id in model_ids:
+        status_reporter.set_status(model_id, "in_progress")
 
     try:
         if invocation_type == 'submission':
-            run_submission(napi, model_id, data_version)
+            failed_model_ids = run_submissions(napi, model_ids, data_version)
         else:
-            run_diagnostics(napi, model_id, data_version)
-
-        set_lambda_status(context.function_name, model_id, request_id, "complete", napi, log_stream_name)
+            failed_model_ids = []
+            for model_id in model_ids:
+                try:
+                    run_diagnostics(napi, model_id, data_version)
+                except Exception as ex:
+                    log_exception()
+                    failed_model_ids.append(model_id)
     except Exception as ex:
-        set_lambda_status(context.function_name, model_id, request_id, "error", napi, log_stream_name)
-        exception_type, exception_value, exception_traceback = sys.exc_info()
-        traceback_string = traceback.format_exception(exception_type, exception_value, exception_traceback)
-        err_msg = json.dumps({
-            "errorType": exception_type.__name__,
-            "errorMessage": str(exception_value),
-            "stackTrace": traceback_string
-        })
-        logger.error(err_msg)
-        return False
-
-    return True
-
-
-def run_submission(napi, model_id, data_version):
-    print(f'Running submission for model_id: {model_id}')
+        log_exception()
+        failed_model_ids = model_ids
+
+    for model_id in model_ids:
+        status = "error" if model_id in failed_model_ids else "complete"
+        status_reporter.set_status(model_id, status)
+    status_reporter.close(timeout=STATUS_FLUSH_TIMEOUT_SECONDS)
+
+    return len(failed_model_ids) == 0
+
+
+def log_exception():
+    exception_type, exception_value, exception_traceback = sys.exc_info()
+    traceback_string = traceback.format_exception(exception_type, exception_value, exception_traceback)
+    err_msg = json.dumps({
+        "errorType": exception_type.__name__,
+        "errorMessage": str(exception_value),
+        "stackTrace": traceback_string
+    })
+    logger.error(err_msg)
+
+
+def run_submissions(napi, model_ids, data_version):
+    """
+    Predict and submit live predictions for every model in model_ids, downloading
+    and decoding the live data only once for the union of their features.
+    Returns the model ids that failed.
+    """
+    print(f'Running submission for model_ids: {model_ids}')
     print(f'Data version: {data_version}')
 
-    current_round = napi.get_current_round()
-    live_data = get_data(napi, data_version, 'live')
-    logger.info(f'Downloaded live data')
+    # the round number, live data and every model's features are independent
+    # downloads, so they are all fetched concurrently. Only the small features
+    # files are fetched up front, the models themselves are loaded one at a time
+    with ThreadPoolExecutor(max_workers=FEATURES_DOWNLOAD_WORKERS + 2) as executor:
+        round_future = executor.submit(napi.get_current_round)
+        live_path_future = executor.submit(
+            lambda: get_data_path(napi, data_version, 'live', round_future.result()))
+        feature_futures = {
+            model_id: executor.submit(get_model_features, model_id)
+            for model_id in model_ids
+        }
 
-    model_name = 'model'
-    model, model_wrapper, features = get_model_wrapper_and_features(model_id)
+        failed_model_ids = []
+        model_features = {}
+        for model_id, feature_future in feature_futures.items():
+            try:
+                model_features[model_id] = feature_future.result()
+            except Exception as ex:
+                log_exception()
+                failed_model_ids.append(model_id)
+
+        current_round = round_future.result()
+        live_data_path = live_path_future.result()
+    logger.info(f'Downloaded live data')
 
-    live_data.loc[:, f"preds_{model_name}"] = model.predict(live_data.loc[:, features])
+    if not model_features:
+        return failed_model_ids
+
+    all_features = list(dict.fromkeys(
+        column
+        for model_wrapper, features, _ in model_features.values()
+        for column in features + get_post_predict_columns(model_wrapper, features)
+    ))
+
+    # the next model is downloaded and unpickled while the current one predicts,
+    # so at most two models (plus the bounded model cache) are held with the live data
+    loaded_model_ids = list(model_features)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-load') as loader:
+        model_futures = {loaded_model_ids[0]: loader.submit(load_model, loaded_model_ids[0], *model_features[loaded_model_ids[0]])}
+
+        # only decode the columns the models actually use
+        with metrics.span('parquet_decode', data_type='live'):
+            live_data = read_data(live_data_path, features=all_features)
+
+        for i, model_id in enumerate(loaded_model_ids):
+            if i + 1 < len(loaded_model_ids):
+                next_model_id = loaded_model_ids[i + 1]
+                model_futures[next_model_id] = loader.submit(load_model, next_model_id, *model_features[next_model_id])
+            try:
+                model, model_wrapper, features = model_futures.pop(model_id).result()
+                run_submission(napi, model_id, model, model_wrapper, features, live_data, data_version,
+                               current_round)
+            except Exception as ex:
+                log_exception()
+                failed_model_ids.append(model_id)
+            finally:
+                model = None
+
+    return failed_model_ids
+
+
+def run_submission(napi, model_id, model, model_wrapper, features, live_data, data_version, current_round):
+    print(f'Running submission for model_id: {model_id}')
 
-    live_data["prediction"] = model_wrapper.post_predict(live_data[f"preds_{model_name}"], round_number=current_round)
+    with metrics.span('predict', model_id=model_id):
+        chunks = staged_predict.chunk_frame(live_data)
+        preds = predict_chunks(model, model_wrapper, chunks, features, len(live_data), f"preds_{model_id}")
+    with metrics.span('post_predict', model_id=model_id):
+        post_predict_columns = get_post_predict_columns(model_wrapper, features)
+        predictions = post_predict(model_wrapper, preds, current_round, live_data, post_predict_columns)
     logger.info(f'Live predictions and ranked')
 
-    predict_output_path = f"/tmp/live_predictions_{current_round}.csv"
     if data_version == 'v2':
-        # v2 live data id column is not the index so needs to be specified in output here
-        live_data[["id", "prediction"]].to_csv(predict_output_path, index=False)
-    else:
-        live_data["prediction"].to_csv(predict_output_path)
-
-    print(f'submitting {predict_output_path}')
-    napi.upload_predictions(predict_output_path, model_id=model_id)
+        # v2 live data id column is not the index so needs to be set for the output here
+        predictions = predictions.set_axis(pd.Index(live_data[ID_COL], name=ID_COL))
+
+    with metrics.span('write', model_id=model_id):
+        predictions_buffer = prediction_writer.write_predictions(predictions)
+    print(f'submitting live predictions for round {current_round}')
+    with metrics.span('upload', model_id=model_id):
+        prediction_writer.upload_buffer(napi, predictions_buffer, f"live_predictions_{current_round}.csv", model_id)
     print('submission complete!')
 
 
@@ -99,60 +253,108 @@ def run_diagnostics(napi, model_id, data_version):
     if data_version == 'v2':
         raise AttributeError('Diagnostics for v2 is not supported')
 
-    # download validation data
-    data_filename = get_data_filename(data_version, 'validation')
-    data_local_path = f"/tmp/{data_version}/{data_filename}"
-    napi.download_dataset(f"{data_version}/{data_filename}", data_local_path)
+    # download validation data and the model concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        round_future = executor.submit(napi.get_current_round)
+        data_path_future = executor.submit(
+            lambda: get_data_path(napi, data_version, 'validation', round_future.result()))
+        model_future = executor.submit(get_model_wrapper_and_features, model_id)
+        data_local_path = data_path_future.result()
+        model, model_wrapper, features = model_future.result()
     logger.info(f'Downloaded validation data')
 
+    # fail before predicting when post processing can't hold the whole file
+    post_predict_columns = get_post_predict_columns(model_wrapper, features)
+    check_post_predict_memory(data_local_path, post_predict_columns)
+
     # predict on validation data
     model_name = 'model'
-    model, model_wrapper, features = get_model_wrapper_and_features(model_id)
 
-    predictions = []
     gc.collect()
 
-    parquet_file = pq.ParquetFile(data_local_path)
-    for batch in parquet_file.iter_batches(batch_size=32000, columns=features, use_pandas_metadata=True):
-        batch_df = batch.to_pandas()
-        batch_df.loc[:, f"preds_{model_name}"] = model.predict(batch_df.loc[:, features])
-        batch_df["prediction"] = model_wrapper.post_predict(batch_df[f"preds_{model_name}"], round_number=None)
-        predictions.append(batch_df["prediction"])
-
-    preds = pd.concat(predictions)
-    preds = preds.to_frame()
+    # the next batches are decoded on a background thread while pre_predict and
+    # predict run on the current ones, so this span covers decode and predict
+    num_rows = pq.ParquetFile(data_local_path).metadata.num_rows
+    with metrics.span('predict', model_id=model_id, data_type='validation'):
+        # the staged predict holds its chunks in flight and their pre_predict outputs
+        held_batches = staged_predict.MAX_CHUNKS_IN_FLIGHT * staged_predict.FRAMES_PER_CHUNK_IN_FLIGHT
+        chunks = batch_reader.prefetch_batches(data_local_path, columns=features, held_batches=held_batches)
+        raw_preds = predict_chunks(model, model_wrapper, chunks, features, num_rows, f"preds_{model_name}")
+    with metrics.span('post_predict', model_id=model_id, data_type='validation'):
+        # only the columns post processing needs (e.g. era) are read for the whole file, by row group
+        post_predict_data = None
+        if post_predict_columns:
+            post_predict_data = batch_reader.read_columns(data_local_path, columns=post_predict_columns)
+        preds = post_predict(model_wrapper, raw_preds, None, post_predict_data, post_predict_columns)
+
+    with metrics.span('write', model_id=model_id, data_type='validation'):
+        predictions_buffer = prediction_writer.write_predictions(preds)
+    with metrics.span('upload', model_id=model_id, data_type='validation'):
+        diagnostics_id = prediction_writer.upload_buffer(
+            napi, predictions_buffer, "validation_predictions.csv", model_id, diagnostics=True)
+    logger.info(f'diagnostics submitted, id: {diagnostics_id}')
 
-    predict_output_path = f"/tmp/validation_predictions.csv"
-    preds["prediction"].to_csv(predict_output_path)
 
-    diagnostics_id = napi.upload_diagnostics(predict_output_path, tournament=8, model_id=model_id)
-    logger.info(f'diagnostics submitted, id: {diagnostics_id}')
+def predict_chunks(model, model_wrapper, chunks, features, num_rows, name):
+    """
+    Run the staged pre_predict/predict pipeline over chunks and stream the raw
+    predictions into one preallocated buffer, so post_predict can rank them in a
+    single pass instead of within each chunk.
+    """
+    model = limit_threads(model)
+    raw_predictions = np.empty(num_rows, dtype=np.float64)
+    ids = np.empty(num_rows, dtype=object)
+    offset = 0
+    for index, chunk_predictions in staged_predict.predict_in_stages(model, model_wrapper, chunks, features):
+        chunk_rows = len(chunk_predictions)
+        raw_predictions[offset:offset + chunk_rows] = chunk_predictions
+        ids[offset:offset + chunk_rows] = index
+        offset += chunk_rows
+    return pd.Series(raw_predictions[:offset], index=pd.Index(ids[:offset], name=ID_COL), name=name)
+
+
+def limit_threads(model):
+    # runs after the model is loaded so threadpoolctl sees every native library it uses
+    thread_pools = cpu_quota.limit_thread_pools(num_threads)
+    logger.info(f'Predicting with {num_threads} threads (from {num_threads_source}), thread pools: {thread_pools}')
+    return cpu_quota.limit_model_threads(model, num_threads)
+
+
+def get_post_predict_columns(model_wrapper, features):
+    # custom pipelines that don't extend DefaultPipeline don't declare any
+    if not hasattr(model_wrapper, 'post_predict_columns'):
+        return []
+    return model_wrapper.post_predict_columns(features)
+
+
+def check_post_predict_memory(data_local_path, post_predict_columns, memory_budget=None):
+    """
+    Raise if the post processing data of the whole file would not fit in the
+    memory budget. neutralize holds every row's exposures twice, once as read
+    and once as the era sorted float32 copy it fits on.
+    """
+    if not post_predict_columns:
+        return
+    if memory_budget is None:
+        memory_budget = batch_reader.get_memory_budget()
+    parquet_file = pq.ParquetFile(data_local_path)
+    exposure_columns = [col for col in post_predict_columns if col != ERA_COL]
+    row_bytes = (batch_reader.estimate_row_bytes(parquet_file, post_predict_columns) * batch_reader.PANDAS_CONVERSION_FACTOR
+                 + NEUTRALIZE_BYTES_PER_EXPOSURE * len(exposure_columns) + POST_PREDICT_BYTES_PER_ROW)
+    needed = parquet_file.metadata.num_rows * row_bytes
+    if needed > memory_budget:
+        raise ValueError(
+            f'Post processing {parquet_file.metadata.num_rows} rows with {len(exposure_columns)} neutralization '
+            f'features needs about {needed / 2**30:.1f} GB, more than the {memory_budget / 2**30:.1f} GB memory '
+            f'budget. Neutralize on fewer features (the "features" option of the step) or give the Lambda more memory.')
 
 
-def set_lambda_status(function_name, model_id, request_id, status, napi, log_stream_name=None):
-    query = f'''
-        mutation setModelLambdaStatus($function_name: String!, $model_id: String!, $request_id: String!, $status: String!, $log_stream_name: String) {{
-          modelLambdaStatus(
-            functionName: $function_name, 
-            modelId: $model_id, 
-            requestId: $request_id, 
-            status: $status,
-            logStreamName: $log_stream_name) {{
-            requestId
-          }}
-        }}
-        '''
-    napi.raw_query(
-        query=query,
-        authorization=True,
-        variables={
-            'function_name': function_name,
-            'model_id': model_id,
-            'request_id': request_id,
-            'status': status,
-            'log_stream_name': log_stream_name
-        }
-    )
+def post_predict(model_wrapper, predictions, round_number, data, post_predict_columns):
+    # data is only passed to pipelines that asked for columns, so custom
+    # post_predict overrides with the old signature keep working
+    if not post_predict_columns:
+        return model_wrapper.post_predict(predictions, round_number=round_number)
+    return model_wrapper.post_predict(predictions, round_number=round_number, data=data[post_predict_columns])
 
 
 def get_data_filename(data_version, data_type):
@@ -161,48 +363,180 @@ def get_data_filename(data_version, data_type):
     return f'{data_type}.parquet'
 
 
-def get_data(napi, data_version, data_type):
-    data_filename = get_data_filename(data_version, data_type)
-    data_local_path = f"/tmp/{data_version}/{data_filename}"
-    napi.download_dataset(f"{data_version}/{data_filename}", data_local_path)
-    return pd.read_parquet(data_local_path)
+def get_read_columns(data_local_path, features):
+    # id is the index in v3+ files (restored from the pandas metadata), but a
+    # plain column in v2, so keep whichever id/era columns the file actually has
+    schema_names = set(pq.read_schema(data_local_path).names)
+    extra_columns = [col for col in [ID_COL, ERA_COL] if col in schema_names and col not in features]
+    return extra_columns + list(features)
 
 
-def get_model_wrapper_and_features(model_id):
-    s3 = boto3.client('s3')
-    aws_account_id = boto3.client('sts').get_caller_identity().get('Account')
+def get_data_path(napi, data_version, data_type, round_num):
+    data_filename = get_data_filename(data_version, data_type)
+    with metrics.span('download_data', data_type=data_type):
+        return dataset_cache.get(napi, data_version, data_filename, round_num)
+
+
+def read_data(data_local_path, features=None):
+    # the live file is small and every model of an invocation predicts on it and
+    # post processes with it, so it is read once and kept whole. Validation data
+    # is streamed by row group instead, see batch_reader.prefetch_batches
+    if features is None:
+        return pd.read_parquet(data_local_path)
+    return pd.read_parquet(data_local_path, columns=get_read_columns(data_local_path, features))
+
+
+def get_s3_client():
+    # shared with every thread and kept warm between invocations, see aws_clients
+    return aws_clients.get_client('s3')
+
+
+def get_aws_account_id():
+    return aws_clients.get_account_id()
+
+
+def get_object_version(s3, bucket, key):
+    """The (ETag, VersionId) version of an S3 object and its size in bytes."""
+    head = s3.head_object(Bucket=bucket, Key=key)
+    return (head['ETag'], head.get('VersionId')), head.get('ContentLength', 0)
+
+
+def get_model_cache_budget():
+    return batch_reader.get_memory_budget(MODEL_CACHE_MEMORY_FRACTION)
+
+
+def cache_model(model_id, entry):
+    """
+    Add entry to model_cache unless it doesn't fit the byte budget. Only models
+    that the current invocation hasn't used are evicted to make room, least
+    recently used first. An invocation that runs more models than fit keeps the
+    ones that were already cached instead of every new model evicting the one
+    that runs next, so the next invocation still gets hits. Call with
+    model_cache_lock held.
+    """
+    budget = get_model_cache_budget()
+    used = sum(cached['bytes'] for cached in model_cache.values())
+    evictable = [key for key, cached in model_cache.items() if cached['generation'] != entry['generation']]
+    for key in evictable:
+        if used + entry['bytes'] <= budget:
+            break
+        used -= model_cache.pop(key)['bytes']
+        logger.info(f'Evicted model {key} from the model cache')
+    if used + entry['bytes'] > budget:
+        logger.info(f'Not caching model {model_id}, the model cache budget of {budget} bytes is used up')
+        return
+    model_cache[model_id] = entry
+
+
+def download_model_manifest(s3, bucket, model_id, model_wrapper, pickle_prefix):
+    """
+    Download the model manifest written by DefaultPipeline.pickle and return the
+    paths of the model artifacts it points to (several for an ensemble), along
+    with the manifest's contents. Models uploaded without a manifest (and
+    pipelines that don't use one) fall back to pickled_model_path.
+    """
+    manifest_path = getattr(model_wrapper, 'model_manifest_path', None)
+    if manifest_path is None:
+        return [model_wrapper.pickled_model_path], None
+
+    local_path = f'{pickle_prefix}/{manifest_path}'
+    try:
+        s3.download_file(bucket, f'{model_id}/{manifest_path}', local_path)
+    except botocore_exceptions.ClientError as ex:
+        if ex.response['Error']['Code'] not in ['404', 'NoSuchKey']:
+            raise
+        # don't let a manifest from an earlier upload of this model linger
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        return model_wrapper.model_artifact_paths(pickle_prefix), None
+    with open(local_path, 'rb') as f:
+        manifest = f.read()
+    return model_wrapper.model_artifact_paths(pickle_prefix), manifest
+
+
+def get_model_wrapper(model_id):
     try:
         from custom_pipeline import CustomPipeline
-        model_wrapper = CustomPipeline(model_id)
+        return CustomPipeline(model_id)
     except Exception as ex:
         print('No custom model wrapper found, using default')
-        model_wrapper = DefaultPipeline(model_id)
-
-    pickle_prefix = '/tmp'
-    s3.download_file(
-        f'numerai-compute-{aws_account_id}',
-        f'{model_id}/{model_wrapper.pickled_model_path}',
-        f'{pickle_prefix}/{model_wrapper.pickled_model_path}')
-    model = model_wrapper.unpickle(pickle_prefix)
-
-    s3.download_file(f'numerai-compute-{aws_account_id}', f'{model_id}/features.json', '/tmp/features.json')
-    f = open('/tmp/features.json')
-    features = json.load(f)
-    logger.info(f'Loaded features {model_id}/features.json')
-    return model, model_wrapper, features
+        return model_pipeline.DefaultPipeline(model_id)
+
 
+def get_model_prefix(model_id):
+    # models may be loaded concurrently, so each one gets its own directory
+    pickle_prefix = f'/tmp/models/{model_id}'
+    os.makedirs(pickle_prefix, exist_ok=True)
+    return pickle_prefix
 
-def read_parquet_via_pandas_generator(filename, batch_size=128, reads_per_file=5):
-    num_rows = ParquetFile(filename).metadata.num_rows
-    cache_size = math.ceil(num_rows / batch_size / reads_per_file) * batch_size
-    batch_count = math.ceil(cache_size / batch_size)
-    for n_read in range(reads_per_file):
-        cache = pd.read_parquet(filename).iloc[cache_size * n_read: cache_size * (n_read + 1)].copy()
-        gc.collect()
-        sleep(1)  # sleep(1) is required to allow measurement of the garbage collector
-        for n_batch in range(batch_count):
-            yield cache[batch_size * n_batch: batch_size * (n_batch + 1)].copy()
 
+def get_model_features(model_id):
+    """
+    The model's pipeline, its features and the version of features.json,
+    without downloading or unpickling the model itself.
+    """
+    features_object = get_s3_client().get_object(
+        Bucket=f'numerai-compute-{get_aws_account_id()}', Key=f'{model_id}/features.json')
+    features = json.loads(features_object['Body'].read())
+    logger.info(f'Loaded features {model_id}/features.json')
+    return get_model_wrapper(model_id), features, (features_object['ETag'], features_object.get('VersionId'))
+
+
+def get_model_wrapper_and_features(model_id):
+    return load_model(model_id, *get_model_features(model_id))
+
+
+def load_model(model_id, model_wrapper, features, features_version):
+    """
+    Download and unpickle the model, or take it from model_cache when neither
+    its artifacts, manifest nor features.json changed. The pipeline and
+    features come from get_model_features, so they aren't fetched again.
+    """
+    s3 = get_s3_client()
+    bucket = f'numerai-compute-{get_aws_account_id()}'
+    pickle_prefix = get_model_prefix(model_id)
+
+    artifact_paths, manifest = download_model_manifest(s3, bucket, model_id, model_wrapper, pickle_prefix)
+
+    # ensembles have several artifacts, so they are checked and downloaded concurrently
+    with ThreadPoolExecutor(max_workers=len(artifact_paths)) as executor:
+        heads = list(executor.map(lambda path: get_object_version(s3, bucket, f'{model_id}/{path}'), artifact_paths))
+    versions = tuple((path, version) for path, (version, _) in zip(artifact_paths, heads))
+    model_bytes = sum(size for _, size in heads)
+    # the manifest holds e.g. ensemble weights and member formats, which can
+    # change without any of the artifacts changing
+    versions += (('manifest', manifest), ('features.json', features_version))
+
+    # warm containers keep the unpickled model around, so only download and
+    # unpickle again when any object changed in S3
+    with model_cache_lock:
+        cached = model_cache.get(model_id)
+        if cached is not None and cached['versions'] == versions:
+            model_cache.move_to_end(model_id)
+            cached['generation'] = model_cache_generation
+            logger.info(f'Using cached model for {model_id}')
+            # the pipeline that unpickled the model, custom ones may keep state from unpickle
+            return cached['model'], cached['model_wrapper'], features
+        # a changed model is reloaded, don't keep the old one alive meanwhile
+        model_cache.pop(model_id, None)
+
+    with metrics.span('download_model', model_id=model_id):
+        with ThreadPoolExecutor(max_workers=len(artifact_paths)) as executor:
+            list(executor.map(
+                lambda path: s3.download_file(bucket, f'{model_id}/{path}', f'{pickle_prefix}/{path}'),
+                artifact_paths))
+    with metrics.span('unpickle', model_id=model_id):
+        model = model_wrapper.unpickle(pickle_prefix)
+
+    with model_cache_lock:
+        cache_model(model_id, {
+            'versions': versions,
+            'model': model,
+            'model_wrapper': model_wrapper,
+            'bytes': model_bytes,
+            'generation': model_cache_generation,
+        })
+    return model, model_wrapper, features
 
 
 if __name__ == '__main__':
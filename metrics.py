@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger()
+
+DEFAULT_NAMESPACE = 'NumeraiCompute'
+# set to a path to also append every metric record there as a json line
+METRICS_FILE_ENV = 'NUMERAI_COMPUTE_METRICS_FILE'
+
+
+def read_peak_rss_mb():
+    """Peak resident set size of this process in MB since the last reset."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on linux and can't be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    # writing 5 to clear_refs resets VmHWM to the current RSS (linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Span:
+
+    def __init__(self, name, properties):
+        self.name = name
+        self.properties = properties
+        self.start = time.perf_counter()
+        self.peak_rss_mb = 0.0
+
+
+# Times named stages of an invocation and records the peak RSS reached during
+# each of them. Every finished span is printed as a CloudWatch embedded metric
+# format record, which CloudWatch turns into Duration and PeakRSS metrics per
+# stage, and optionally appended to a local json lines file.
+class Metrics:
+
+    def __init__(self, namespace=DEFAULT_NAMESPACE, dimensions=None, file_path=None, stream=None):
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.file_path = file_path if file_path is not None else os.environ.get(METRICS_FILE_ENV)
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.open_spans = []
+
+    @contextmanager
+    def span(self, name, **properties):
+        with self.lock:
+            # the peak is reset for the new span, so fold it into the spans
+            # that are still open (they may be nested or on other threads)
+            current_peak = read_peak_rss_mb()
+            for open_span in self.open_spans:
+                open_span.peak_rss_mb = max(open_span.peak_rss_mb, current_peak)
+            reset_peak_rss()
+            span = Span(name, properties)
+            self.open_spans.append(span)
+        try:
+            yield span
+        finally:
+            duration_ms = (time.perf_counter() - span.start) * 1000
+            with self.lock:
+                self.open_spans.remove(span)
+                span.peak_rss_mb = max(span.peak_rss_mb, read_peak_rss_mb())
+            self.emit(span.name, duration_ms, span.peak_rss_mb, span.properties)
+
+    def emit(self, stage, duration_ms, peak_rss_mb, properties=None):
+        dimensions = dict(self.dimensions, Stage=stage)
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [
+                        {'Name': 'Duration', 'Unit': 'Milliseconds'},
+                        {'Name': 'PeakRSS', 'Unit': 'Megabytes'},
+                    ],
+                }],
+            },
+            **dimensions,
+            **(properties or {}),
+            'Duration': round(duration_ms, 3),
+            'PeakRSS': round(peak_rss_mb, 3),
+        }
+        line = json.dumps(record, default=str)
+        with self.lock:
+            print(line, file=self.stream or sys.stdout, flush=True)
+            if self.file_path:
+                with open(self.file_path, 'a') as f:
+                    f.write(line + '\n')
+        return record
@@ -1,4 +1,78 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import postprocessing
+
+
+PICKLE_FORMAT = 'pickle'
+LIGHTGBM_FORMAT = 'lightgbm'
+JOBLIB_FORMAT = 'joblib'
+ENSEMBLE_FORMAT = 'ensemble'
+
+MODEL_FORMAT_PATHS = {
+    PICKLE_FORMAT: 'model.pkl',
+    LIGHTGBM_FORMAT: 'model.txt',
+    JOBLIB_FORMAT: 'model.joblib',
+}
+
+
+class EnsembleModel:
+    """
+    Weighted blend of several models. Members predict in parallel on a thread
+    pool (LightGBM and most numpy heavy estimators release the GIL while
+    predicting), so an ensemble takes about as long as its slowest member.
+    """
+
+    def __init__(self, models, weights=None):
+        self.models = list(models)
+        if weights is None:
+            weights = np.ones(len(self.models))
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def predict(self, data):
+        def member_predict(model):
+            return np.asarray(model.predict(data), dtype=np.float64).reshape(-1)
+
+        with ThreadPoolExecutor(max_workers=len(self.models)) as executor:
+            predictions = list(executor.map(member_predict, self.models))
+        return np.column_stack(predictions) @ (self.weights / self.weights.sum())
+
+
+def detect_model_format(model):
+    module = type(model).__module__
+    if module.startswith('lightgbm'):
+        import lightgbm as lgb
+        # a regressor predicts exactly what its booster does, classifiers
+        # would return probabilities instead of labels when loaded as a booster
+        if isinstance(model, (lgb.Booster, lgb.LGBMRegressor)):
+            return LIGHTGBM_FORMAT
+        return JOBLIB_FORMAT
+    if module.startswith('sklearn') or module.startswith('numpy'):
+        return JOBLIB_FORMAT
+    return PICKLE_FORMAT
+
+
+def save_model(model, path, model_format):
+    if model_format == LIGHTGBM_FORMAT:
+        booster = model if type(model).__name__ == 'Booster' else model.booster_
+        booster.save_model(path)
+    elif model_format == JOBLIB_FORMAT:
+        import joblib
+        # uncompressed so the arrays can be memory mapped when loading
+        joblib.dump(model, path)
+    else:
+        pd.to_pickle(model, path)
+
+
+def load_model(path, model_format):
+    if model_format == LIGHTGBM_FORMAT:
+        import lightgbm as lgb
+        return lgb.Booster(model_file=path)
+    if model_format == JOBLIB_FORMAT:
+        import joblib
+        return joblib.load(path, mmap_mode='r')
+    return pd.read_pickle(path)
 
 
 # This is the default model wrapper that can be extended for
@@ -6,19 +80,64 @@ import pandas as pd
 class DefaultPipeline:
 
     pickled_model_path = 'model.pkl'
+    model_manifest_path = 'model_manifest.json'
+    # (name, options) steps run in order by post_predict, see postprocessing.apply_steps.
+    # e.g. [('neutralize', {'proportion': 0.5}), ('rank_per_era', {})]
+    # predictions have to end up in [0, 1], so finish with a rank step
+    post_processing_steps = [('rank', {})]
 
     def __init__(self, model_id: str):
         self.model_id = model_id
 
     def pickle(self, model):
-        pd.to_pickle(model, self.pickled_model_path)
+        # the manifest records how the model was saved so the lambda loads it with the same format
+        if isinstance(model, EnsembleModel):
+            members = []
+            for i, (member, weight) in enumerate(zip(model.models, model.weights)):
+                member_format = detect_model_format(member)
+                member_path = f'member_{i}_{MODEL_FORMAT_PATHS[member_format]}'
+                save_model(member, member_path, member_format)
+                members.append({'format': member_format, 'path': member_path, 'weight': float(weight)})
+            manifest = {'format': ENSEMBLE_FORMAT, 'members': members}
+        else:
+            model_format = detect_model_format(model)
+            model_path = MODEL_FORMAT_PATHS[model_format]
+            save_model(model, model_path, model_format)
+            manifest = {'format': model_format, 'path': model_path}
+        with open(self.model_manifest_path, 'w') as f:
+            json.dump(manifest, f)
+
+    def read_manifest(self, pickle_prefix: str):
+        try:
+            with open(f'{pickle_prefix}/{self.model_manifest_path}') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # models saved before manifests existed are plain pickles
+            return {'format': PICKLE_FORMAT, 'path': self.pickled_model_path}
+
+    def model_artifact_paths(self, pickle_prefix: str):
+        manifest = self.read_manifest(pickle_prefix)
+        if manifest['format'] == ENSEMBLE_FORMAT:
+            return [member['path'] for member in manifest['members']]
+        return [manifest['path']]
 
     def unpickle(self, pickle_prefix: str):
-        return pd.read_pickle(f'{pickle_prefix}/{self.pickled_model_path}')
+        manifest = self.read_manifest(pickle_prefix)
+        if manifest['format'] == ENSEMBLE_FORMAT:
+            members = manifest['members']
+            with ThreadPoolExecutor(max_workers=len(members)) as executor:
+                models = list(executor.map(
+                    lambda member: load_model(f'{pickle_prefix}/{member["path"]}', member['format']), members))
+            return EnsembleModel(models, [member['weight'] for member in members])
+        return load_model(f'{pickle_prefix}/{manifest["path"]}', manifest['format'])
 
     def pre_predict(self, data):
-        pass
+        # runs on every chunk before predict, return the transformed chunk
+        # (returning None keeps the chunk as is)
+        return data
 
-    def post_predict(self, predictions, round_number):
-        return predictions.rank(pct=True)
+    def post_predict_columns(self, features):
+        return postprocessing.get_step_columns(self.post_processing_steps, features)
 
+    def post_predict(self, predictions, round_number, data=None):
+        return postprocessing.apply_steps(predictions, self.post_processing_steps, data)
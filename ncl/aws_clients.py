@@ -0,0 +1,63 @@
+import threading
+
+
+# one boto3 session and one client per service for the whole process. Clients
+# are thread safe and keep their connection pool between calls, but creating
+# them resolves endpoints and credentials and is not thread safe itself
+session = None
+clients = {}
+account_id = None
+lock = threading.RLock()
+
+MAX_POOL_CONNECTIONS = 50
+MAX_ATTEMPTS = 10
+
+
+def get_config():
+    import botocore.config
+    options = {
+        # enough connections for the thread pools that download models and deploy fleets
+        'max_pool_connections': MAX_POOL_CONNECTIONS,
+        # adaptive mode also rate limits the client when AWS starts throttling
+        'retries': {'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS},
+        'tcp_keepalive': True,
+    }
+    try:
+        return botocore.config.Config(**options)
+    except TypeError:
+        # tcp_keepalive needs botocore >= 1.27.84, pooled connections are reused either way
+        del options['tcp_keepalive']
+        return botocore.config.Config(**options)
+
+
+def get_session():
+    global session
+    with lock:
+        if session is None:
+            import boto3
+            session = boto3.session.Session()
+    return session
+
+
+def get_client(service_name):
+    with lock:
+        if service_name not in clients:
+            clients[service_name] = get_session().client(service_name, config=get_config())
+        return clients[service_name]
+
+
+def get_account_id():
+    global account_id
+    with lock:
+        if account_id is None:
+            account_id = get_client('sts').get_caller_identity().get('Account')
+    return account_id
+
+
+def reset(new_session=None):
+    """Drop every cached client, e.g. after credentials changed. new_session replaces the boto3 session."""
+    global session, account_id
+    with lock:
+        session = new_session
+        clients.clear()
+        account_id = None
@@ -1,34 +1,24 @@
-import boto3
-import botocore.config
 import collections
-import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from ncl import aws_clients
 
 
-def start_build(repo_name, cb_project_name):
+def start_build(repo_name, cb_project_name, image_tag=None):
     args = {"projectName": cb_project_name}
-    session = boto3.session.Session()
-    client = session.client("codebuild")
+    if image_tag is not None:
+        # buildspec.yml tags and pushes the image as $IMAGE_TAG
+        args["environmentVariablesOverride"] = [
+            {"name": "IMAGE_TAG", "value": image_tag, "type": "PLAINTEXT"},
+        ]
+    client = aws_clients.get_client("codebuild")
 
     response = client.start_build(**args)
     return response["build"]["id"]
 
 
 def wait_for_build(id, poll_seconds=10):
-    session = boto3.session.Session()
-    client = session.client("codebuild")
-    status = client.batch_get_builds(ids=[id])
-    first = True
-    while status["builds"][0]["buildStatus"] == "IN_PROGRESS":
-        if not first:
-            print(".", end="")
-            sys.stdout.flush()
-        first = False
-        time.sleep(poll_seconds)
-        status = client.batch_get_builds(ids=[id])
-    print()
-    print(f"Build complete, status = {status['builds'][0]['buildStatus']}")
-    print(f"Logs at {status['builds'][0]['logs']['deepLink']}")
+    return watch_builds([id], log=False, max_poll=poll_seconds)[id]
 
 
 # Position is a tuple that includes the last read timestamp and the number of items that were read
@@ -36,14 +26,6 @@ def wait_for_build(id, poll_seconds=10):
 Position = collections.namedtuple("Position", ["timestamp", "skip"])
 
 
-class LogState(object):
-    STARTING = 1
-    WAIT_IN_PROGRESS = 2
-    TAILING = 3
-    JOB_COMPLETE = 4
-    COMPLETE = 5
-
-
 def log_stream(client, log_group, stream_name, position):
     start_time, skip = position
     next_token = None
@@ -80,93 +62,127 @@ def log_stream(client, log_group, stream_name, position):
             yield ev, position
 
 
-def logs_for_build(
-        build_id, wait=False, poll=10, session=None
-):  # noqa: C901 - suppress complexity warning for this method
-
-    codebuild = boto3.client("codebuild")
-    description = codebuild.batch_get_builds(ids=[build_id])["builds"][0]
-    status = description["buildStatus"]
-
-    log_group = description["logs"].get("groupName")
-    stream_name = description["logs"].get("streamName")  # The list of log streams
-    position = Position(
-        timestamp=0, skip=0
-    )  # The current position in each stream, map of stream name -> position
-
-    # Increase retries allowed (from default of 4), as we don't want waiting for a build
-    # to be interrupted by a transient exception.
-    config = botocore.config.Config(retries={"max_attempts": 15})
-    client = boto3.client("logs", config=config)
-
-    job_already_completed = False if status == "IN_PROGRESS" else True
-
-    state = (
-        LogState.STARTING if wait and not job_already_completed else LogState.COMPLETE
-    )
-    dot = True
-
-    while state == LogState.STARTING and log_group == None:
-        time.sleep(poll)
-        description = codebuild.batch_get_builds(ids=[build_id])["builds"][0]
-        log_group = description["logs"].get("groupName")
-        stream_name = description["logs"].get("streamName")
-
-    if state == LogState.STARTING:
-        state = LogState.TAILING
-
-    # The loop below implements a state machine that alternates between checking the build status and
-    # reading whatever is available in the logs at this point. Note, that if we were called with
-    # wait == False, we never check the job status.
-    #
-    # If wait == TRUE and job is not completed, the initial state is STARTING
-    # If wait == FALSE, the initial state is COMPLETE (doesn't matter if the job really is complete).
-    #
-    # The state table:
-    #
-    # STATE               ACTIONS                        CONDITION               NEW STATE
-    # ----------------    ----------------               -------------------     ----------------
-    # STARTING            Pause, Get Status              Valid LogStream Arn     TAILING
-    #                                                    Else                    STARTING
-    # TAILING             Read logs, Pause, Get status   Job complete            JOB_COMPLETE
-    #                                                    Else                    TAILING
-    # JOB_COMPLETE        Read logs, Pause               Any                     COMPLETE
-    # COMPLETE            Read logs, Exit                                        N/A
-    #
-    # Notes:
-    # - The JOB_COMPLETE state forces us to do an extra pause and read any items that got to Cloudwatch after
-    #   the build was marked complete.
-    last_describe_job_call = time.time()
-    dot_printed = False
-    while True:
-        for event, position in log_stream(client, log_group, stream_name, position):
-            print(event["message"].rstrip())
-            if dot:
-                dot = False
-                if dot_printed:
-                    print()
-        if state == LogState.COMPLETE:
-            break
-
-        time.sleep(poll)
-        if dot:
-            print(".", end="")
-            sys.stdout.flush()
-            dot_printed = True
-        if state == LogState.JOB_COMPLETE:
-            state = LogState.COMPLETE
-        elif time.time() - last_describe_job_call >= 30:
-            description = codebuild.batch_get_builds(ids=[build_id])["builds"][0]
-            status = description["buildStatus"]
-
-            last_describe_job_call = time.time()
-
-            status = description["buildStatus"]
-
-            if status != "IN_PROGRESS":
-                print()
-                state = LogState.JOB_COMPLETE
-
-    if wait:
-        if dot:
-            print()
+# batch_get_builds accepts at most this many ids per call
+MAX_BATCH_GET_BUILDS = 100
+
+
+def batch_get_builds(client, build_ids):
+    builds = {}
+    for start in range(0, len(build_ids), MAX_BATCH_GET_BUILDS):
+        response = client.batch_get_builds(ids=build_ids[start:start + MAX_BATCH_GET_BUILDS])
+        for build in response["builds"]:
+            builds[build["id"]] = build
+    return builds
+
+
+class BuildWatcher:
+    """
+    Follows any number of builds at once. Every tick reads the new events of
+    the unfinished builds' log streams concurrently. The builds' status is
+    checked less often, at most every status_interval seconds, with one
+    batch_get_builds call per 100 ids. The exceptions are builds whose log
+    stream doesn't exist yet, and watching without logs.
+
+    The pause between ticks adapts to activity: it drops to min_poll while log
+    events are flowing and doubles up to max_poll while nothing happens. A
+    build's logs are read once more on the tick after it finished, to pick up
+    events that reached CloudWatch after the build was marked complete.
+    """
+
+    def __init__(self, build_ids, log=True, min_poll=5, max_poll=30, status_interval=30, max_workers=16):
+        self.build_ids = list(build_ids)
+        self.log = log
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.status_interval = status_interval
+        self.max_workers = max_workers
+        self.last_status = None
+        self.codebuild = aws_clients.get_client("codebuild")
+        self.logs = aws_clients.get_client("logs")
+        self.builds = {}
+        self.positions = {build_id: Position(timestamp=0, skip=0) for build_id in self.build_ids}
+        self.finishing = set()
+
+    def read_logs(self, build):
+        log_group = build["logs"].get("groupName")
+        stream_name = build["logs"].get("streamName")
+        if log_group is None or stream_name is None:
+            # the stream only exists once the build container started
+            return []
+        messages = []
+        for event, position in log_stream(self.logs, log_group, stream_name, self.positions[build["id"]]):
+            messages.append(event["message"].rstrip())
+            self.positions[build["id"]] = position
+        return messages
+
+    def print_logs(self, build_id, messages):
+        prefix = f"[{build_id}] " if len(self.build_ids) > 1 else ""
+        for message in messages:
+            print(f"{prefix}{message}")
+
+    def needs_status(self, pending):
+        if not self.log or self.last_status is None:
+            return True
+        if any(self.builds[build_id]["logs"].get("streamName") is None for build_id in pending):
+            return True
+        return time.monotonic() - self.last_status >= self.status_interval
+
+    def tick(self, executor, pending):
+        """Print the pending builds' new log events, returns (still pending, event count)."""
+        # builds that already finished only wait for their final log read
+        unfinished = [build_id for build_id in pending if build_id not in self.finishing]
+        if unfinished and self.needs_status(unfinished):
+            self.builds.update(batch_get_builds(self.codebuild, unfinished))
+            self.last_status = time.monotonic()
+        event_count = 0
+        if self.log:
+            # each stream is read on its own thread, output is printed per build in order
+            futures = [(build_id, executor.submit(self.read_logs, self.builds[build_id])) for build_id in pending]
+            for build_id, future in futures:
+                messages = future.result()
+                event_count += len(messages)
+                self.print_logs(build_id, messages)
+
+        still_pending = []
+        for build_id in pending:
+            if build_id in self.finishing:
+                self.report(self.builds[build_id])
+            else:
+                still_pending.append(build_id)
+                if self.builds[build_id]["buildStatus"] != "IN_PROGRESS":
+                    self.finishing.add(build_id)
+        return still_pending, event_count
+
+    def report(self, build):
+        print(f"Build {build['id']} complete, status = {build['buildStatus']}")
+        if build["logs"].get("deepLink"):
+            print(f"Logs at {build['logs']['deepLink']}")
+
+    def wait(self):
+        """Follow the builds until all of them finished, returns their final descriptions by id."""
+        pending = list(self.build_ids)
+        poll = self.min_poll
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="build-logs") as executor:
+            while pending:
+                pending, event_count = self.tick(executor, pending)
+                if not pending:
+                    break
+                poll = self.min_poll if event_count else min(self.max_poll, poll * 2)
+                # finished builds get their last read soon instead of after a long idle pause
+                time.sleep(self.min_poll if self.finishing.intersection(pending) else poll)
+        return self.builds
+
+    def read_once(self):
+        """Print the logs written so far without waiting for the builds."""
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="build-logs") as executor:
+            self.tick(executor, list(self.build_ids))
+        return self.builds
+
+
+def watch_builds(build_ids, log=True, wait=True, min_poll=5, max_poll=30, status_interval=30):
+    watcher = BuildWatcher(build_ids, log=log, min_poll=min_poll, max_poll=max_poll, status_interval=status_interval)
+    return watcher.wait() if wait else watcher.read_once()
+
+
+def logs_for_build(build_id, wait=False, poll=10, session=None):
+    return watch_builds([build_id], log=True, wait=wait, max_poll=poll)[build_id]
@@ -1,4 +1,5 @@
-import boto3
+import hashlib
+import json
 import os
 import urllib.request
 import shutil
@@ -7,31 +8,161 @@ import tempfile
 import time
 import zipfile
 import collections
-import boto3
-import botocore.config
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from ncl import aws_clients
 from ncl.codebuild_helpers import start_build, logs_for_build, wait_for_build
-
-
-def deploy(lambda_handler_path, pickled_model_path, model_id, model_name):
-    aws_account_id = boto3.client('sts').get_caller_identity().get('Account')
-    bucket_name = maybe_create_bucket(aws_account_id)
-
-    # TODO: only run these steps if requirements.txt file changes
-    zip_file_key = maybe_create_zip_file(model_id, bucket_name)
-    # TODO: need ability to not use default repo? feature not needed til later tho
-    ecr = maybe_create_ecr_repo()
-
-    cb_project_name = maybe_create_codebuild_project(
-        aws_account_id,
-        bucket_name,
-        zip_file_key,
-        ecr['repositoryName']
-    )
-
-    maybe_build_container(ecr['repositoryName'], cb_project_name, log=True)
-
-    maybe_create_lambda_function(model_name, ecr, bucket_name, aws_account_id)
+from ncl.step_graph import run_steps
+
+
+# files copied from the working directory into the codebuild bundle, see the
+# COPY instructions in the Dockerfile
+HANDLER_FILES = [
+    'requirements.txt',
+    'lambda_handler.py',
+    'model_pipeline.py',
+    'postprocessing.py',
+    'dataset_cache.py',
+    'batch_reader.py',
+    'prediction_writer.py',
+    'staged_predict.py',
+    'cpu_quota.py',
+    # the boto3 client registry is shared with the deploy code
+    'ncl/__init__.py',
+    'ncl/aws_clients.py',
+    'status_reporter.py',
+    'metrics.py',
+    'custom_pipeline.py',
+]
+# the Dockerfile copies custom_pipeline.py only if it exists, every other handler file is required
+OPTIONAL_HANDLER_FILES = {'custom_pipeline.py'}
+
+# build files taken from the compute-lite repo rather than the working directory
+# key prefix of the codebuild bundles in the account's bucket, one per deploy
+# (or 'shared' for deploy_many), the codebuild role may read all of them
+CODEBUILD_ZIP_PREFIX = 'codebuild-sagemaker-container-'
+BUILD_FILE_URLS = {
+    'Dockerfile': 'https://raw.githubusercontent.com/numerai/compute-lite/master/Dockerfile',
+    'buildspec.yml': 'https://raw.githubusercontent.com/numerai/compute-lite/master/buildspec.yml',
+    'entry.sh': 'https://raw.githubusercontent.com/numerai/compute-lite/master/entry.sh',
+}
+
+
+def deploy(lambda_handler_path, pickled_model_path, model_id, model_name, force_build=False):
+    """
+    Build the lambda image if needed and create or update the model's lambda
+    function, see run_deploy_steps.
+    """
+    def lambda_function(results):
+        return create_or_update_lambda_function(aws_clients.get_client('lambda'), model_name, results['ecr'],
+                                                results['lambda_role'], results['image_tag'])
+
+    run_deploy_steps(model_id, force_build, {
+        'lambda_function': (['lambda_role', 'build'], lambda_function),
+    })
+
+
+def deploy_many(models, force_build=False, max_workers=8):
+    """
+    Deploy several models that share one container image. models is a list of
+    dicts with model_id, model_name and optionally artifact_paths, local files
+    (e.g. model_manifest.json, model.txt, features.json) uploaded to the
+    model's s3 prefix.
+
+    The image is built at most once, then every model's artifacts are uploaded
+    and its lambda function created or updated on a pool of max_workers
+    threads. Returns a dict of model_id to its result: status 'deployed' with
+    the function_name, or status 'error' with the error message.
+    """
+    # the lambda role and its policy are shared by every function, so they are set up once up front
+    shared = run_deploy_steps('shared', force_build)
+
+    s3 = aws_clients.get_client('s3')
+    lambda_client = aws_clients.get_client('lambda')
+
+    def deploy_model(model):
+        upload_model_artifacts(s3, shared['bucket'], model['model_id'], model.get('artifact_paths', []))
+        resp = create_or_update_lambda_function(
+            lambda_client, model['model_name'], shared['ecr'], shared['lambda_role'], shared['image_tag'])
+        return resp['FunctionName']
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {model['model_id']: executor.submit(deploy_model, model) for model in models}
+        for model_id, future in futures.items():
+            try:
+                results[model_id] = {'status': 'deployed', 'function_name': future.result()}
+            except Exception as ex:
+                results[model_id] = {'status': 'error', 'error': str(ex)}
+            print(f'{model_id}: {results[model_id]}')
+    return results
+
+
+def run_deploy_steps(bundle_id, force_build=False, steps=None):
+    """
+    Run the provisioning steps every deploy needs, plus any extra steps, as a
+    dependency graph (see ncl.step_graph) and return every step's result.
+
+    The shared steps set up the account's bucket, the ECR repo and the lambda
+    execution role, and build the lambda image unless ECR already has it. The
+    image is tagged with a hash of everything that goes into it, so
+    redeploying unchanged code (e.g. only a new model) skips the build.
+    Independent steps, e.g. the ECR repo, the bucket and both IAM roles, run at
+    the same time. The result of 'image_tag' is the tag to deploy, 'ecr',
+    'bucket' and 'lambda_role' hold the other resources.
+    """
+    with tempfile.TemporaryDirectory() as build_dir:
+
+        def image_missing(results):
+            if not force_build and image_exists(results['ecr']['repositoryName'], results['image_tag']):
+                print(f'Image {results["ecr"]["repositoryName"]}:{results["image_tag"]} already exists, '
+                      f'skipping container build')
+                return False
+            return True
+
+        def codebuild_role(results):
+            if results['image_missing']:
+                return maybe_create_codebuild_role(results['account'], results['ecr']['repositoryName'],
+                                                   results['bucket'])
+
+        def zip_file(results):
+            if results['image_missing']:
+                return maybe_create_zip_file(bundle_id, results['bucket'], results['build_files'])
+
+        def codebuild_project(results):
+            if results['image_missing']:
+                return maybe_create_codebuild_project(results['account'], results['bucket'], results['zip_file'],
+                                                      results['ecr']['repositoryName'], results['codebuild_role'])
+
+        def build(results):
+            if results['image_missing']:
+                maybe_build_container(results['ecr']['repositoryName'], results['codebuild_project'],
+                                      log=True, image_tag=results['image_tag'])
+
+        return run_steps({
+            'account': ([], lambda results: aws_clients.get_account_id()),
+            'bucket': (['account'], lambda results: maybe_create_bucket(results['account'])),
+            # TODO: need ability to not use default repo? feature not needed til later tho
+            'ecr': ([], lambda results: maybe_create_ecr_repo()),
+            'build_files': ([], lambda results: get_build_files(build_dir, os.getcwd())),
+            'image_tag': (['build_files'], lambda results: get_image_tag(results['build_files'])),
+            'image_missing': (['ecr', 'image_tag'], image_missing),
+            'codebuild_role': (['account', 'bucket', 'ecr', 'image_missing'], codebuild_role),
+            'zip_file': (['bucket', 'build_files', 'image_missing'], zip_file),
+            'codebuild_project': (['zip_file', 'codebuild_role'], codebuild_project),
+            'build': (['codebuild_project'], build),
+            'lambda_role': (['account', 'bucket'],
+                            lambda results: maybe_create_lambda_role(results['bucket'], results['account'])),
+            **(steps or {}),
+        })
+
+
+def upload_model_artifacts(s3, bucket_name, model_id, artifact_paths):
+    # the handler downloads everything from the model's prefix, see lambda_handler.get_model_wrapper_and_features
+    for path in artifact_paths:
+        key = f'{model_id}/{os.path.basename(path)}'
+        s3.upload_file(path, bucket_name, key)
+        print(f'Uploaded {path} to s3://{bucket_name}/{key}')
 
 
 def maybe_create_bucket(aws_account_id):
@@ -40,57 +171,81 @@ def maybe_create_bucket(aws_account_id):
 
     # create_bucket is idempotent, so it will create or return the existing bucket
     # if this step fails, an exception will be raised
-    boto3.client('s3').create_bucket(Bucket=bucket_name)
+    aws_clients.get_client('s3').create_bucket(Bucket=bucket_name)
     return bucket_name
 
 
-def maybe_create_zip_file(model_id, bucket_name):
-    # ideally we would only do this step if the requirements.txt changes. but until then
-    # this will just run every time
-    orig_dir = os.getcwd()
+def get_build_files(build_dir, handler_dir):
+    """
+    Returns (path, archive name) for every file of the codebuild bundle: the
+    Dockerfile, buildspec and entry.sh downloaded into build_dir, then the
+    handler files found in handler_dir, in the order they are zipped. Raises
+    FileNotFoundError if a required handler file is missing, since the
+    Dockerfile copies each of them by name and the build would fail later.
+    """
+    # TODO: need way to support user modified Dockerfile?
+    build_files = []
+    for name, url in BUILD_FILE_URLS.items():
+        path = os.path.join(build_dir, name)
+        urllib.request.urlretrieve(url, path)
+        build_files.append((path, name))
+
+    # only the top level, subdirectories (e.g. codebuild_files) may hold stale copies
+    # under the same names, and the fixed order keeps the image tag stable
+    missing = []
+    for file in HANDLER_FILES:
+        path = os.path.join(handler_dir, file)
+        if os.path.isfile(path):
+            build_files.append((path, file))
+        elif file not in OPTIONAL_HANDLER_FILES:
+            missing.append(file)
+    if missing:
+        raise FileNotFoundError(f'Handler files {missing} not found in {handler_dir}, deploy from the directory '
+                                f'that holds lambda_handler.py and its modules')
+    return build_files
+
+
+def get_image_tag(build_files):
+    digest = hashlib.sha256()
+    for path, name in build_files:
+        digest.update(name.encode())
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return f'build-{digest.hexdigest()[:20]}'
+
+
+def image_exists(repo_name, image_tag):
     try:
-        with tempfile.TemporaryDirectory() as td:
-
-            key = f"codebuild-sagemaker-container-{model_id}.zip"
-            os.chdir(td)
-
-            # TODO: need way to support user modified Dockerfile?
-
-            # download dockerfile and buildspec from git
-            dockerfile_url = 'https://raw.githubusercontent.com/numerai/compute-lite/master/Dockerfile'
-            buildspec_url = 'https://raw.githubusercontent.com/numerai/compute-lite/master/buildspec.yml'
-            entrysh_url = 'https://raw.githubusercontent.com/numerai/compute-lite/master/entry.sh'
-
-            urllib.request.urlretrieve(dockerfile_url, 'Dockerfile')
-            urllib.request.urlretrieve(buildspec_url, 'buildspec.yml')
-            urllib.request.urlretrieve(entrysh_url, 'entry.sh')
-
-            with tempfile.TemporaryFile() as tmp:
-                with zipfile.ZipFile(tmp, "w") as zip:
-                    for dirname, _, filelist in os.walk("."):
-                        for file in filelist:
-                            if file == 'Dockerfile' or file == 'buildspec.yml' or file == 'entry.sh':
-                                print(f"{dirname}/{file}")
-                                zip.write(f"{dirname}/{file}")
-
-                    for dirname, _, filelist in os.walk(orig_dir):
-                        for file in filelist:
-                            if file == 'requirements.txt' or file == 'lambda_handler.py':
-                                print(f"{dirname}/{file}")
-                                zip.write(f"{dirname}/{file}", file)
-                tmp.seek(0)
-                s3 = boto3.session.Session().client("s3")
-                s3.upload_fileobj(tmp, bucket_name, key)
-                print(f'Uploaded codebuild zip file: s3://{bucket_name}/{key}')
-    finally:
-        os.chdir(orig_dir)
+        aws_clients.get_client('ecr').describe_images(repositoryName=repo_name, imageIds=[{'imageTag': image_tag}])
+        return True
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'ImageNotFoundException':
+            return False
+        raise
+
+
+def maybe_create_zip_file(model_id, bucket_name, build_files=None):
+    with tempfile.TemporaryDirectory() as td:
+        if build_files is None:
+            build_files = get_build_files(td, os.getcwd())
+
+        key = f"{CODEBUILD_ZIP_PREFIX}{model_id}.zip"
+        with tempfile.TemporaryFile() as tmp:
+            with zipfile.ZipFile(tmp, "w") as zip:
+                for path, name in build_files:
+                    print(path)
+                    zip.write(path, name)
+            tmp.seek(0)
+            s3 = aws_clients.get_client('s3')
+            s3.upload_fileobj(tmp, bucket_name, key)
+            print(f'Uploaded codebuild zip file: s3://{bucket_name}/{key}')
     return key
 
 
 def maybe_create_ecr_repo():
     repo_name = 'numerai-compute-lambda-image'
 
-    client = boto3.client('ecr')
+    client = aws_clients.get_client('ecr')
     try:
         ecr_resp = client.create_repository(
             repositoryName=repo_name
@@ -107,7 +262,9 @@ def maybe_create_ecr_repo():
     return ecr_resp['repository']
 
 
-def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, repo_name):
+def maybe_create_codebuild_role(aws_account_id, repo_name, bucket_name=None):
+    if bucket_name is None:
+        bucket_name = f'numerai-compute-{aws_account_id}'
     role_name = 'codebuild-numerai-container-role'
     assume_role_policy_doc = '''{
         "Version": "2012-10-17",
@@ -173,18 +330,17 @@ def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, re
                 "ecr:CreateRepository"
             ],
             "Resource": [
-                "arn:aws:s3:::numerai-compute-984109184174/codebuild-sagemaker-container-102052af-a3f4-44ea-b4e4-8d419d3ee4e2.zip",
-                "arn:aws:s3:::numerai-compute-984109184174/codebuild-sagemaker-container-102052af-a3f4-44ea-b4e4-8d419d3ee4e2.zip/*",
-                "arn:aws:codebuild:us-east-1:984109184174:report-group/create-numerai-container-numerai-compute-*",
-                "arn:aws:ecr:us-east-1:984109184174:repository/*",
-                "arn:aws:logs:us-east-1:984109184174:log-group:/aws/codebuild/{cb_project_name}",
-                "arn:aws:logs:us-east-1:984109184174:log-group:/aws/codebuild/{cb_project_name}:*"
+                "arn:aws:s3:::{bucket_name}/{CODEBUILD_ZIP_PREFIX}*.zip",
+                "arn:aws:codebuild:us-east-1:{aws_account_id}:report-group/create-numerai-container-numerai-compute-*",
+                "arn:aws:ecr:us-east-1:{aws_account_id}:repository/*",
+                "arn:aws:logs:us-east-1:{aws_account_id}:log-group:/aws/codebuild/{cb_project_name}",
+                "arn:aws:logs:us-east-1:{aws_account_id}:log-group:/aws/codebuild/{cb_project_name}:*"
             ]
         }},
         {{
             "Effect": "Allow",
             "Resource": [
-                "arn:aws:s3:::numerai-compute-984109184174"
+                "arn:aws:s3:::{bucket_name}"
             ],
             "Action": [
                 "s3:ListBucket",
@@ -217,7 +373,7 @@ def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, re
                 "ecr:GetLifecyclePolicy",
                 "ecr:CreateRepository"
             ],
-            "Resource": "arn:aws:ecr:us-east-1:984109184174:repository/*"
+            "Resource": "arn:aws:ecr:us-east-1:{aws_account_id}:repository/*"
         }},
         {{
             "Effect": "Allow",
@@ -237,10 +393,16 @@ def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, re
 }}
     '''
     maybe_create_policy_and_attach_role(policy_name, policy_document, aws_account_id, codebuild_role)
+    return codebuild_role
 
-    session = boto3.session.Session()
-    region = session.region_name
-    client = session.client("codebuild")
+
+def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, repo_name, codebuild_role=None):
+    if codebuild_role is None:
+        codebuild_role = maybe_create_codebuild_role(aws_account_id, repo_name, bucket_name)
+    cb_project_name = f"build-{repo_name}"
+
+    region = aws_clients.get_session().region_name
+    client = aws_clients.get_client('codebuild')
     codebuild_zipfile = f'{bucket_name}/{zip_file_key}'
 
     base_image = 'public.ecr.aws/lambda/python:3.9'
@@ -250,6 +412,9 @@ def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, re
         "description": f"Build the container {repo_name} for running notebooks in SageMaker",
         "source": {"type": "S3", "location": codebuild_zipfile},
         "artifacts": {"type": "NO_ARTIFACTS"},
+        # keeps docker layers on the build host between builds that run close together,
+        # the dependency image pushed to ECR (see buildspec.yml) covers the rest
+        "cache": {"type": "LOCAL", "modes": ["LOCAL_DOCKER_LAYER_CACHE"]},
         "environment": {
             "type": "LINUX_CONTAINER",
             "image": "aws/codebuild/standard:4.0",
@@ -266,93 +431,117 @@ def maybe_create_codebuild_project(aws_account_id, bucket_name, zip_file_key, re
         "serviceRole": codebuild_role['Arn'],
     }
 
-    try:
-        response = client.create_project(**args)
-    except Exception as ex:
-        print('Unable to create project, trying delete and recreate..')
-        client.delete_project(name=cb_project_name)
-        response = client.create_project(**args)
-        print('Project recreated')
+    projects = client.batch_get_projects(names=[cb_project_name])['projects']
+    if not projects:
+        client.create_project(**args)
+        print(f'Created project {cb_project_name}')
+    elif settings_differ(args, projects[0]):
+        client.update_project(**args)
+        print(f'Updated project {cb_project_name}')
+    else:
+        print(f'Project {cb_project_name} is up to date')
 
     return cb_project_name
 
 
+def settings_differ(desired, current):
+    """
+    Whether any setting in desired is missing from or different in current.
+    Settings that only exist in current (defaults filled in by AWS, creation
+    dates, ...) are ignored.
+    """
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return True
+        return any(key not in current or settings_differ(value, current[key]) for key, value in desired.items())
+    if isinstance(desired, list):
+        if not isinstance(current, list) or len(desired) != len(current):
+            return True
+        return any(settings_differ(d, c) for d, c in zip(desired, current))
+    return desired != current
+
+
+def is_no_such_entity(ex):
+    return ex.response['Error']['Code'] == 'NoSuchEntity'
+
+
 def create_or_get_role(role_name, assume_role_policy_document, description):
+    iam = aws_clients.get_client('iam')
     try:
-        iam_response = boto3.client('iam').create_role(
+        role = iam.get_role(RoleName=role_name)['Role']
+    except ClientError as ex:
+        if not is_no_such_entity(ex):
+            raise
+        print(f'Creating role {role_name}')
+        return iam.create_role(
             RoleName=role_name,
             AssumeRolePolicyDocument=assume_role_policy_document,
             Description=description,
-        )
-    except Exception as ex:
-        print(f'Unable to create role {role_name}, trying to retrieve..')
-        iam_response = boto3.client('iam').get_role(RoleName=role_name)
+        )['Role']
+
+    # boto3 returns the role's trust policy already decoded
+    if settings_differ(json.loads(assume_role_policy_document), role['AssumeRolePolicyDocument']):
+        print(f'Updating the trust policy of role {role_name}')
+        iam.update_assume_role_policy(RoleName=role_name, PolicyDocument=assume_role_policy_document)
 
     # TODO: would be cool to dataclass this
-    return iam_response['Role']
+    return role
 
 
 def maybe_create_policy_and_attach_role(policy_name, policy_document, aws_account_id, role):
+    iam = aws_clients.get_client('iam')
+    policy_arn = f'arn:aws:iam::{aws_account_id}:policy/{policy_name}'
     try:
-        policy = boto3.client('iam').create_policy(
-            PolicyName=policy_name,
-            PolicyDocument=policy_document
-        )
-    except Exception as ex:
-        print(f'Unable to create policy, deleting and recreating..')
-        policy_arn = f'arn:aws:iam::{aws_account_id}:policy/{policy_name}'
-        try:
-            boto3.client('iam').detach_role_policy(
-                RoleName=role['RoleName'],
-                PolicyArn=policy_arn
-            )
-        except Exception as ex:
-            print(f'Policy already detached. deleting..')
-
-        # if policy has mutliple versions, you gotta delete those
-        # before deleting the policy
-        policy_versions = boto3.client('iam').list_policy_versions(
-            PolicyArn=policy_arn
-        )
-        for pv in policy_versions['Versions']:
-            if pv['IsDefaultVersion']:
-                continue
-            boto3.client('iam').delete_policy_version(
-                PolicyArn=policy_arn,
-                VersionId=pv['VersionId']
-            )
-
-        boto3.client('iam').delete_policy(
+        policy = iam.get_policy(PolicyArn=policy_arn)['Policy']
+    except ClientError as ex:
+        if not is_no_such_entity(ex):
+            raise
+        policy = None
+
+    if policy is None:
+        print(f'Creating policy {policy_name}')
+        iam.create_policy(PolicyName=policy_name, PolicyDocument=policy_document)
+    else:
+        current_document = iam.get_policy_version(
+            PolicyArn=policy_arn,
+            VersionId=policy['DefaultVersionId']
+        )['PolicyVersion']['Document']
+        # compared as parsed json, so whitespace and key order don't count as changes
+        if json.loads(policy_document) != current_document:
+            # a policy keeps at most 5 versions, make room by deleting the oldest
+            versions = iam.list_policy_versions(PolicyArn=policy_arn)['Versions']
+            old_versions = sorted((v for v in versions if not v['IsDefaultVersion']), key=lambda v: v['CreateDate'])
+            if len(versions) >= 5:
+                iam.delete_policy_version(PolicyArn=policy_arn, VersionId=old_versions[0]['VersionId'])
+            iam.create_policy_version(PolicyArn=policy_arn, PolicyDocument=policy_document, SetAsDefault=True)
+            print(f'Updated policy {policy_name}')
+
+    attached = iam.list_attached_role_policies(RoleName=role['RoleName'])['AttachedPolicies']
+    if policy_arn not in [p['PolicyArn'] for p in attached]:
+        iam.attach_role_policy(
+            RoleName=role['RoleName'],
             PolicyArn=policy_arn
         )
-        print(f'deleted {policy_arn}')
-        policy = boto3.client('iam').create_policy(
-            PolicyName=policy_name,
-            PolicyDocument=policy_document
-        )
-
-    # attach role policy is idempotent, thx jeff
-    boto3.client('iam').attach_role_policy(
-        RoleName=role['RoleName'],
-        PolicyArn=policy['Policy']['Arn']
-    )
     return True
 
 
-def maybe_build_container(repo_name, cb_project_name, log=True):
+def maybe_build_container(repo_name, cb_project_name, log=True, image_tag='latest'):
     try:
-        id = start_build(repo_name, cb_project_name)
+        id = start_build(repo_name, cb_project_name, image_tag)
         if log:
-            logs_for_build(id, wait=True)
+            build = logs_for_build(id, wait=True)
         else:
-            wait_for_build(id)
+            build = wait_for_build(id)
+        # the lambda is pointed at this image's tag next, which only exists if the build pushed it
+        if build['buildStatus'] != 'SUCCEEDED':
+            raise RuntimeError(f'Build {id} of {repo_name}:{image_tag} finished with status {build["buildStatus"]}')
     except Exception as ex:
         raise ex
     finally:
         print('delete project lol')
 
 
-def maybe_create_lambda_function(model_name, ecr, bucket_name, aws_account_id):
+def maybe_create_lambda_role(bucket_name, aws_account_id):
     lambda_role_name = 'numerai-compute-lambda-execution-role'
     assume_role_policy_document = '''{
             "Version": "2012-10-17",
@@ -382,7 +571,8 @@ def maybe_create_lambda_function(model_name, ecr, bucket_name, aws_account_id):
     description = 'Lambda execution role created for Numerai Compute'
     lambda_role = create_or_get_role(lambda_role_name, assume_role_policy_document, description)
 
-    function_name = f'numerai-compute-{model_name}-submit'
+    # one policy is shared by the functions of every model
+    function_name = 'numerai-compute-*-submit'
 
     lambda_policy_doc = f'''{{
                 "Version": "2012-10-17",
@@ -464,11 +654,12 @@ def maybe_create_lambda_function(model_name, ecr, bucket_name, aws_account_id):
     '''
     lambda_policy_name = 'numerai-compute-lambda-execution-policy'
     maybe_create_policy_and_attach_role(lambda_policy_name, lambda_policy_doc, aws_account_id, lambda_role)
+    return lambda_role
 
-    client = boto3.client('lambda')
 
+def create_or_update_lambda_function(client, model_name, ecr, lambda_role, image_tag='latest'):
     repo_uri = ecr['repositoryUri']
-    image_uri = f'{repo_uri}:latest'
+    image_uri = f'{repo_uri}:{image_tag}'
 
     function_name = f'numerai-compute-{model_name}-submit'
 
@@ -484,7 +675,7 @@ def maybe_create_lambda_function(model_name, ecr, bucket_name, aws_account_id):
             Timeout=300
         )
     except Exception as ex:
-        print('Unable to create function, trying update to latest ECR image..')
+        print(f'Unable to create function, trying update to ECR image {image_uri}..')
         resp = client.update_function_code(
             FunctionName=function_name,
             ImageUri=image_uri
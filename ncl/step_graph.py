@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def run_steps(steps, max_workers=8, report=True):
+    """
+    Run a graph of steps on a thread pool. steps maps a step name to a tuple
+    (dependencies, function): function is called with a dict of the results
+    of every finished step once all of its dependencies are done, so
+    independent steps run concurrently. Returns the results by step name.
+
+    If a step raises, no new steps are started and the exception is raised
+    once the running ones finished. The start time and duration of every
+    step is printed at the end unless report is False.
+    """
+    for name, (dependencies, _) in steps.items():
+        unknown = [d for d in dependencies if d not in steps]
+        if unknown:
+            raise ValueError(f'Step {name} depends on unknown steps {unknown}')
+
+    results = {}
+    timings = {}
+    remaining = dict(steps)
+    running = {}
+    error = None
+    start = time.perf_counter()
+
+    def run_step(name, function):
+        step_start = time.perf_counter()
+        try:
+            return function(results)
+        finally:
+            timings[name] = (step_start - start, time.perf_counter() - step_start)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='deploy-step') as executor:
+        while True:
+            if error is None:
+                ready = [name for name, (dependencies, _) in remaining.items()
+                         if all(d in results for d in dependencies)]
+                for name in ready:
+                    _, function = remaining.pop(name)
+                    running[executor.submit(run_step, name, function)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as ex:
+                    error = error or ex
+
+    if report:
+        print_timings(timings, time.perf_counter() - start)
+    if error is not None:
+        raise error
+    if remaining:
+        raise ValueError(f'Steps {sorted(remaining)} have circular dependencies')
+    return results
+
+
+def print_timings(timings, total):
+    print('Step timings:')
+    for name, (started, duration) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print(f'    {name:<20} started {started:7.2f} s   took {duration:7.2f} s')
+    print(f'    {"total":<20} {"":17} took {total:7.2f} s')
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+ERA_COL = 'era'
+FEATURE_PREFIX = 'feature'
+
+
+def rank(values):
+    return pd.Series(values).rank(pct=True).to_numpy()
+
+
+def rank_per_era(values, eras):
+    return pd.Series(values).groupby(pd.factorize(eras)[0]).rank(pct=True).to_numpy()
+
+
+def gaussianize(values, eras=None):
+    """Map values to standard normal quantiles of their (per era) ranks."""
+    from scipy.special import ndtri
+    if eras is None:
+        codes = np.zeros(len(values), dtype=np.int64)
+    else:
+        codes = pd.factorize(eras)[0]
+    ranks = pd.Series(values).groupby(codes).rank(method='average').to_numpy()
+    counts = np.bincount(codes)[codes]
+    # centering the ranks keeps the extremes away from 0 and 1, where ndtri is infinite
+    return ndtri((ranks - 0.5) / counts)
+
+
+def neutralize(values, exposures, eras=None, proportion=1.0):
+    """
+    Remove proportion of the linear exposure of values to the exposures matrix
+    within every era, then scale each era to unit standard deviation.
+
+    Rows are sorted by era once into a contiguous float32 matrix, so every era's
+    least squares fit runs on a contiguous slice instead of a fancy-indexed copy.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if eras is None:
+        codes = np.zeros(len(values), dtype=np.int64)
+    else:
+        codes = pd.factorize(eras)[0]
+    order = np.argsort(codes, kind='stable')
+    boundaries = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+
+    sorted_exposures = np.ascontiguousarray(np.asarray(exposures)[order], dtype=np.float32)
+    sorted_values = values[order]
+    neutralized = np.empty_like(sorted_values)
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        x = sorted_exposures[start:end]
+        y = sorted_values[start:end]
+        beta = np.linalg.lstsq(x, y.astype(np.float32), rcond=None)[0]
+        residual = y - proportion * (x @ beta)
+        std = residual.std()
+        neutralized[start:end] = residual / std if std > 0 else residual
+
+    result = np.empty_like(neutralized)
+    result[order] = neutralized
+    return result
+
+
+def get_step_columns(steps, features=None):
+    """Columns of the data that post processing steps need besides the predictions."""
+    columns = []
+    for name, options in steps:
+        if name in ['rank_per_era', 'gaussianize', 'neutralize']:
+            columns.append(ERA_COL)
+        if name == 'neutralize':
+            columns.extend(options.get('features') or features or [])
+    return list(dict.fromkeys(columns))
+
+
+def apply_steps(predictions, steps, data=None):
+    """
+    Apply post processing steps in order to a predictions Series. Steps are
+    (name, options) tuples, where name is one of rank, rank_per_era, gaussianize
+    or neutralize. Per era steps read the era column from data, and neutralize
+    uses options['features'] (or every feature column in data) as exposures.
+    """
+    values = predictions.to_numpy(dtype=np.float64)
+    if data is not None and len(data) != len(values):
+        raise ValueError(f'post processing data has {len(data)} rows, predictions have {len(values)}')
+    eras = data[ERA_COL].to_numpy() if data is not None and ERA_COL in data else None
+
+    for name, options in steps:
+        if name == 'rank':
+            values = rank(values)
+        elif name == 'rank_per_era':
+            values = rank(values) if eras is None else rank_per_era(values, eras)
+        elif name == 'gaussianize':
+            values = gaussianize(values, eras)
+        elif name == 'neutralize':
+            if data is None:
+                raise ValueError('neutralize needs the feature data')
+            features = options.get('features') or [c for c in data.columns if c.startswith(FEATURE_PREFIX)]
+            values = neutralize(values, data[features].to_numpy(), eras, options.get('proportion', 1.0))
+        else:
+            raise ValueError(f'Unknown post processing step: {name}')
+
+    return pd.Series(values, index=predictions.index, name=predictions.name)
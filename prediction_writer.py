@@ -0,0 +1,93 @@
+import os
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import requests
+
+
+ID_COL = 'id'
+PREDICTION_COL = 'prediction'
+
+UPLOAD_TIMEOUT = 600
+
+
+def predictions_to_table(predictions):
+    """Build an arrow table with id and prediction columns from a pandas Series indexed by id."""
+    return pa.table({
+        ID_COL: pa.array(predictions.index.astype(str)),
+        PREDICTION_COL: pa.array(predictions.to_numpy(), type=pa.float64()),
+    })
+
+
+def write_predictions(predictions, file_format='csv'):
+    """
+    Serialize predictions into an in-memory arrow buffer with arrow's native
+    csv or parquet writer, which avoids pandas' per-value float formatting.
+    """
+    table = predictions_to_table(predictions)
+    sink = pa.BufferOutputStream()
+    if file_format == 'csv':
+        pa_csv.write_csv(table, sink)
+    elif file_format == 'parquet':
+        pq.write_table(table, sink)
+    else:
+        raise ValueError(f'Unsupported predictions format: {file_format}')
+    return sink.getvalue()
+
+
+def upload_buffer(napi, buffer, filename, model_id, diagnostics=False, tournament=8):
+    """
+    Upload a predictions buffer from memory. This follows the same
+    auth -> put -> create mutation flow as NumerAPI.upload_predictions and
+    upload_diagnostics, but streams the buffer instead of reading a file from disk.
+
+    numerapi has no public call for the auth and create steps alone, so this
+    uses the private _upload_auth and copies the create mutations. numerapi
+    is pinned in requirements.txt and tests/test_prediction_writer.py fails
+    when either drifts from the public upload methods.
+    """
+    if diagnostics:
+        auth_endpoint = 'diagnosticsUploadAuth'
+        create_query = '''
+            mutation($filename: String!
+                     $tournament: Int!
+                     $modelId: String) {
+                createDiagnostics(filename: $filename
+                                  tournament: $tournament
+                                  modelId: $modelId) {
+                    id
+                }
+            }'''
+        result_field = 'createDiagnostics'
+        headers = {}
+    else:
+        auth_endpoint = 'submission_upload_auth'
+        create_query = '''
+            mutation($filename: String!
+                     $tournament: Int!
+                     $modelId: String
+                     $triggerId: String) {
+                create_submission(filename: $filename
+                                  tournament: $tournament
+                                  modelId: $modelId
+                                  triggerId: $triggerId
+                                  source: "numerapi") {
+                    id
+                }
+            }'''
+        result_field = 'create_submission'
+        headers = {'x_compute_id': os.getenv('NUMERAI_COMPUTE_ID')}
+
+    upload_auth = napi._upload_auth(auth_endpoint, filename, tournament, model_id)
+    response = requests.put(upload_auth['url'], data=pa.BufferReader(buffer), headers=headers, timeout=UPLOAD_TIMEOUT)
+    response.raise_for_status()
+
+    arguments = {
+        'filename': upload_auth['filename'],
+        'tournament': tournament,
+        'modelId': model_id,
+    }
+    if not diagnostics:
+        arguments['triggerId'] = os.getenv('TRIGGER_ID', None)
+    create = napi.raw_query(create_query, arguments, authorization=True)
+    return create['data'][result_field]['id']
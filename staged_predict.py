@@ -0,0 +1,61 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# rows per chunk when an in-memory frame (e.g. live data) is split into stages
+DEFAULT_CHUNK_ROWS = 50000
+# chunks being prepared or predicted at once by predict_in_stages
+MAX_CHUNKS_IN_FLIGHT = 2
+# a chunk in flight and the frame pre_predict returned for it
+FRAMES_PER_CHUNK_IN_FLIGHT = 2
+
+
+def chunk_frame(data, chunk_rows=DEFAULT_CHUNK_ROWS):
+    for start in range(0, len(data), chunk_rows):
+        yield data.iloc[start:start + chunk_rows]
+
+
+def pre_predict(model_wrapper, chunk):
+    # pre_predict may return a transformed frame, or None after editing the chunk in place
+    prepared = model_wrapper.pre_predict(chunk)
+    return chunk if prepared is None else prepared
+
+
+def predict_in_stages(model, model_wrapper, chunks, features, pre_predict_workers=1,
+                      max_chunks_in_flight=MAX_CHUNKS_IN_FLIGHT):
+    """
+    Run model_wrapper.pre_predict and model.predict over chunks as two stages,
+    each on its own executor, so feature engineering for the next chunks
+    overlaps with predicting the current one. Yields (index, predictions) per
+    chunk, in chunk order.
+
+    At most max_chunks_in_flight chunks are being prepared or predicted at once,
+    which bounds the memory held by expensive pre_predict outputs. post_predict
+    is not a chunked stage: ranking and neutralization need every prediction,
+    so callers run it once on the assembled result.
+    """
+    in_flight = collections.deque()
+    features = list(features)
+
+    def predict(pre_future):
+        prepared = pre_future.result()
+        # only select (and copy) the features when the chunk has other columns too
+        if list(prepared.columns) != features:
+            prepared = prepared.loc[:, features]
+        return prepared.index, np.asarray(model.predict(prepared)).reshape(-1)
+
+    with ThreadPoolExecutor(max_workers=pre_predict_workers, thread_name_prefix='pre-predict') as pre_executor, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='predict') as predict_executor:
+        try:
+            for chunk in chunks:
+                pre_future = pre_executor.submit(pre_predict, model_wrapper, chunk)
+                # a single predict worker keeps the results in chunk order
+                in_flight.append(predict_executor.submit(predict, pre_future))
+                while len(in_flight) >= max_chunks_in_flight:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
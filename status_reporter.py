@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger()
+
+IN_PROGRESS = 'in_progress'
+COMPLETE = 'complete'
+ERROR = 'error'
+TERMINAL_STATUSES = {COMPLETE, ERROR}
+
+
+def build_status_mutation(statuses):
+    """
+    Build one GraphQL mutation that sets the lambda status of several models,
+    using an alias per model so a whole batch is a single request.
+    """
+    variable_defs = ['$function_name: String!', '$request_id: String!', '$log_stream_name: String']
+    fields = []
+    variables = {}
+    for i, (model_id, status) in enumerate(statuses.items()):
+        variable_defs.append(f'$model_id_{i}: String!')
+        variable_defs.append(f'$status_{i}: String!')
+        fields.append(f'''
+          status_{i}: modelLambdaStatus(
+            functionName: $function_name,
+            modelId: $model_id_{i},
+            requestId: $request_id,
+            status: $status_{i},
+            logStreamName: $log_stream_name) {{
+            requestId
+          }}''')
+        variables[f'model_id_{i}'] = model_id
+        variables[f'status_{i}'] = status
+
+    query = f'''
+        mutation setModelLambdaStatus({', '.join(variable_defs)}) {{{''.join(fields)}
+        }}
+        '''
+    return query, variables
+
+
+# Reports lambda status transitions from a background thread so the GraphQL
+# round trips stay off the invocation's critical path. Pending transitions are
+# coalesced per model (a terminal status replaces a pending in_progress, and an
+# in_progress arriving after a terminal status is dropped) and every flush sends
+# all pending models in one batched mutation, retried with exponential backoff.
+class StatusReporter:
+
+    def __init__(self, napi, function_name, request_id, log_stream_name=None,
+                 max_attempts=5, backoff_seconds=0.5):
+        self.napi = napi
+        self.function_name = function_name
+        self.request_id = request_id
+        self.log_stream_name = log_stream_name
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+        self.pending = {}
+        self.sending = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='status-reporter', daemon=True)
+        self.thread.start()
+
+    def set_status(self, model_id, status):
+        with self.condition:
+            if status == IN_PROGRESS and self.pending.get(model_id) in TERMINAL_STATUSES:
+                return
+            self.pending[model_id] = status
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every queued transition was sent (or given up on)."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.sending, timeout=timeout)
+
+    def close(self, timeout=None):
+        flushed = self.flush(timeout=timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout=timeout)
+        if not flushed:
+            logger.warning('Lambda status reporter closed before all statuses were sent')
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                statuses = self.pending
+                self.pending = {}
+                self.sending = True
+            try:
+                self._send(statuses)
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
+
+    def _send(self, statuses):
+        query, variables = build_status_mutation(statuses)
+        variables.update({
+            'function_name': self.function_name,
+            'request_id': self.request_id,
+            'log_stream_name': self.log_stream_name,
+        })
+        for attempt in range(self.max_attempts):
+            try:
+                self.napi.raw_query(query=query, authorization=True, variables=variables)
+                return
+            except Exception as ex:
+                if attempt == self.max_attempts - 1:
+                    logger.error(f'Unable to set lambda status {statuses}: {ex}')
+                    return
+                time.sleep(self.backoff_seconds * 2 ** attempt)
@@ -0,0 +1,51 @@
+import threading
+import unittest
+from unittest import mock
+from ncl import aws_clients
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.created = []
+
+    def client(self, service_name, config=None):
+        self.created.append(service_name)
+        client = mock.Mock()
+        client.config = config
+        client.get_caller_identity.return_value = {'Account': '123'}
+        return client
+
+
+class TestAwsClients(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession()
+        aws_clients.reset(self.session)
+
+    def tearDown(self):
+        aws_clients.reset()
+
+    def test_clients_are_created_once_per_service(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(aws_clients.get_client('s3'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.session.created, ['s3'])
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+        config = clients[0].config
+        self.assertEqual(config.max_pool_connections, aws_clients.MAX_POOL_CONNECTIONS)
+        self.assertEqual(config.retries['mode'], 'adaptive')
+
+    def test_account_id_is_cached(self):
+        self.assertEqual(aws_clients.get_account_id(), '123')
+        self.assertEqual(aws_clients.get_account_id(), '123')
+        aws_clients.get_client('sts').get_caller_identity.assert_called_once()
+
+    def test_reset_drops_clients(self):
+        client = aws_clients.get_client('iam')
+        aws_clients.reset(self.session)
+        self.assertIsNot(aws_clients.get_client('iam'), client)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import batch_reader
+from batch_reader import prefetch_batches, choose_batch_size, read_columns, stream_row_groups, MIN_BATCH_SIZE
+
+
+class TestBatchReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'validation.parquet')
+        num_rows = 10000
+        self.data = pd.DataFrame(
+            np.random.randint(0, 5, (num_rows, 10)).astype('int8'),
+            columns=[f'feature_{i}' for i in range(10)],
+            index=pd.Index([f'n{i}' for i in range(num_rows)], name='id'),
+        )
+        self.data.to_parquet(self.path, row_group_size=2500)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_prefetch_batches_yields_all_rows_in_order(self):
+        columns = ['feature_1', 'feature_3']
+        batches = list(prefetch_batches(self.path, columns=columns, batch_size=3000))
+        self.assertEqual([len(b) for b in batches], [3000, 3000, 3000, 1000])
+        pd.testing.assert_frame_equal(pd.concat(batches), self.data[columns])
+
+    def test_prefetch_batches_streams_row_groups_by_default(self):
+        batches = list(prefetch_batches(self.path, memory_budget=1024 * 1024 * 1024))
+        pd.testing.assert_frame_equal(pd.concat(batches), self.data)
+
+    def test_stream_row_groups_merges_small_row_groups(self):
+        parquet_file = pq.ParquetFile(self.path)
+        frames = list(stream_row_groups(parquet_file, columns=['feature_0'], memory_budget=1024 * 1024))
+        self.assertEqual([len(f) for f in frames], [10000])
+        self.assertEqual(frames[0].index.name, 'id')
+
+    def test_stream_row_groups_splits_row_groups_over_budget(self):
+        parquet_file = pq.ParquetFile(self.path)
+        frames = list(stream_row_groups(parquet_file, memory_budget=1))
+        # batches never cross the 2500 row groups
+        self.assertEqual([len(f) for f in frames], [MIN_BATCH_SIZE, MIN_BATCH_SIZE, 500] * 4)
+        pd.testing.assert_frame_equal(pd.concat(frames), self.data)
+
+    def test_read_columns_matches_read_parquet(self):
+        columns = ['feature_2', 'feature_5']
+        frame = read_columns(self.path, columns=columns, memory_budget=4 * 1024)
+        pd.testing.assert_frame_equal(frame, pd.read_parquet(self.path, columns=columns))
+
+    def test_prefetch_batches_budget_covers_the_batches_the_caller_holds(self):
+        with mock.patch('batch_reader.stream_row_groups', wraps=batch_reader.stream_row_groups) as stream:
+            list(prefetch_batches(self.path, memory_budget=1200, queue_size=2, held_batches=3))
+        # 2 queued, 1 being decoded and 3 held by the caller
+        self.assertEqual(stream.call_args.args[2], 200)
+
+    def test_prefetch_batches_can_be_abandoned(self):
+        batches = prefetch_batches(self.path, batch_size=1000, queue_size=1)
+        next(batches)
+        batches.close()
+
+    def test_choose_batch_size_shrinks_with_memory_budget(self):
+        parquet_file = pq.ParquetFile(self.path)
+        large = choose_batch_size(parquet_file, memory_budget=512 * 1024 * 1024)
+        small = choose_batch_size(parquet_file, memory_budget=1024 * 1024)
+        self.assertLess(small, large)
+        self.assertEqual(choose_batch_size(parquet_file, memory_budget=1), MIN_BATCH_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import contextlib
+import io
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from ncl import aws_clients
+from ncl.codebuild_helpers import BuildWatcher, batch_get_builds
+
+
+class FakeBuilds:
+    """Builds that finish after a number of describe calls and log one event per call."""
+
+    def __init__(self, ticks_to_finish):
+        self.ticks_to_finish = ticks_to_finish
+        self.describe_calls = []
+        self.events = {build_id: [] for build_id in ticks_to_finish}
+
+    def batch_get_builds(self, ids):
+        self.describe_calls.append(list(ids))
+        builds = []
+        for build_id in ids:
+            ticks = sum(build_id in call for call in self.describe_calls)
+            finished = ticks >= self.ticks_to_finish[build_id]
+            if ticks <= self.ticks_to_finish[build_id]:
+                self.events[build_id].append({'timestamp': ticks, 'message': f'{build_id} step {ticks}\n'})
+            builds.append({'id': build_id, 'buildStatus': 'SUCCEEDED' if finished else 'IN_PROGRESS',
+                           'logs': {'groupName': 'group', 'streamName': build_id}})
+        return {'builds': builds}
+
+    def get_log_events(self, logGroupName, logStreamName, startTime, startFromHead, nextToken=None):
+        if nextToken is not None:
+            return {'events': [], 'nextForwardToken': nextToken}
+        events = [e for e in self.events[logStreamName] if e['timestamp'] >= startTime]
+        return {'events': events, 'nextForwardToken': 'end'}
+
+
+class FakeSession:
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def client(self, service_name, config=None):
+        return self.fake
+
+
+class TestBuildWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBuilds({'build:a': 2, 'build:b': 4})
+        aws_clients.reset(FakeSession(self.fake))
+
+    def tearDown(self):
+        aws_clients.reset()
+
+    def test_watches_builds_together(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            builds = BuildWatcher(['build:a', 'build:b'], min_poll=0, max_poll=0, status_interval=0).wait()
+
+        self.assertEqual({b['buildStatus'] for b in builds.values()}, {'SUCCEEDED'})
+        # one describe call per tick for the unfinished builds, finished ones only get a final log read
+        self.assertEqual(self.fake.describe_calls, [['build:a', 'build:b']] * 2 + [['build:b']] * 2)
+        lines = output.getvalue().splitlines()
+        for build_id, steps in [('build:a', 2), ('build:b', 4)]:
+            logged = [line for line in lines if line.startswith(f'[{build_id}] ')]
+            self.assertEqual(logged, [f'[{build_id}] {build_id} step {i}' for i in range(1, steps + 1)])
+
+    def test_status_is_checked_less_often_than_logs(self):
+        watcher = BuildWatcher(['build:a', 'build:b'], status_interval=3600)
+        with ThreadPoolExecutor() as executor, contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(3):
+                pending, event_count = watcher.tick(executor, ['build:a', 'build:b'])
+        # the first tick finds the log streams, later ticks only read the logs
+        self.assertEqual(self.fake.describe_calls, [['build:a', 'build:b']])
+        self.assertEqual(pending, ['build:a', 'build:b'])
+
+    def test_batch_get_builds_chunks_ids(self):
+        fake = FakeBuilds({f'build:{i}': 1 for i in range(250)})
+        builds = batch_get_builds(fake, list(fake.ticks_to_finish))
+        self.assertEqual(len(builds), 250)
+        self.assertEqual([len(call) for call in fake.describe_calls], [100, 100, 50])
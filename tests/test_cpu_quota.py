@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from cpu_quota import get_cpu_quota, limit_model_threads, read_cgroup_quota, LightGBMThreads
+from model_pipeline import EnsembleModel
+
+
+class TestCpuQuota(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_cgroup_v2_quota(self):
+        self.write('cpu.max', '150000 100000\n')
+        self.assertEqual(read_cgroup_quota(self.root), 1.5)
+        self.write('cpu.max', 'max 100000\n')
+        self.assertIsNone(read_cgroup_quota(self.root))
+
+    def test_cgroup_v1_quota(self):
+        self.write('cpu,cpuacct/cpu.cfs_quota_us', '200000\n')
+        self.write('cpu,cpuacct/cpu.cfs_period_us', '100000\n')
+        self.assertEqual(read_cgroup_quota(self.root), 2)
+        self.write('cpu,cpuacct/cpu.cfs_quota_us', '-1\n')
+        self.assertIsNone(read_cgroup_quota(self.root))
+
+    @mock.patch('cpu_quota.available_cpus', return_value=4)
+    def test_quota_sources(self, _):
+        with mock.patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': '3008'}):
+            self.assertEqual(get_cpu_quota(self.root), (2, 'lambda memory'))
+            self.write('cpu.max', '50000 100000')
+            self.assertEqual(get_cpu_quota(self.root), (1, 'cgroup'))
+            self.write('cpu.max', '800000 100000')
+            self.assertEqual(get_cpu_quota(self.root), (4, 'cgroup'))
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(get_cpu_quota(os.path.join(self.root, 'missing')), (4, 'cpu affinity'))
+
+    def test_ensemble_members_share_the_threads(self):
+        import lightgbm as lgb
+        from sklearn.linear_model import Ridge
+        data = pd.DataFrame(np.random.rand(200, 3), columns=['a', 'b', 'c'])
+        target = np.random.rand(200)
+        booster = lgb.LGBMRegressor(n_estimators=5, verbose=-1).fit(data, target)
+        ridge = Ridge().fit(data, target)
+        ensemble = EnsembleModel([booster, booster, ridge], [1, 1, 2])
+
+        limited = limit_model_threads(ensemble, 4)
+        self.assertIsInstance(limited.models[0], LightGBMThreads)
+        self.assertEqual(limited.models[0].num_threads, 1)
+        self.assertIs(limited.models[2], ridge)
+        np.testing.assert_allclose(limited.predict(data), ensemble.predict(data))
+        self.assertEqual(limit_model_threads(booster, 4).num_threads, 4)
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import dataset_cache
+from dataset_cache import DatasetCache
+
+
+class FakeResponse:
+
+    def __init__(self, content, content_length):
+        self.content = content
+        self.headers = {'content-length': str(content_length)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FakeNumerAPI:
+    """Hands out dataset urls and serves them, dropping the last truncate bytes of each."""
+
+    def __init__(self, size=100, truncate=0):
+        self.size = size
+        self.truncate = truncate
+        self.downloads = []
+
+    def raw_query(self, query, variables=None, authorization=False):
+        return {'data': {'dataset': f'https://datasets/{variables["filename"]}@{variables["round"]}'}}
+
+    def get(self, url, stream=False, timeout=None):
+        filename, round_num = url[len('https://datasets/'):].split('@')
+        self.downloads.append((filename, int(round_num)))
+        return FakeResponse(os.urandom(self.size - self.truncate), self.size)
+
+
+class TestDatasetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.napi = FakeNumerAPI()
+        self.requests_get = mock.patch('dataset_cache.requests.get', side_effect=lambda *a, **kw: self.napi.get(*a, **kw))
+        self.requests_get.start()
+
+    def tearDown(self):
+        self.requests_get.stop()
+        self.tmp_dir.cleanup()
+
+    def test_same_round_is_downloaded_once(self):
+        cache = DatasetCache(self.tmp_dir.name, max_bytes=1000)
+        first = cache.get(self.napi, 'v4', 'live.parquet', 300)
+        second = DatasetCache(self.tmp_dir.name, max_bytes=1000).get(self.napi, 'v4', 'live.parquet', 300)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.napi.downloads), 1)
+
+    def test_new_round_replaces_old_round(self):
+        cache = DatasetCache(self.tmp_dir.name, max_bytes=1000)
+        old_path = cache.get(self.napi, 'v4', 'live.parquet', 300)
+        cache.get(self.napi, 'v4', 'live.parquet', 301)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(len(self.napi.downloads), 2)
+
+    def test_corrupted_file_is_downloaded_again(self):
+        cache = DatasetCache(self.tmp_dir.name, max_bytes=1000, verify_hash=True)
+        path = cache.get(self.napi, 'v4', 'live.parquet', 300)
+        with open(path, 'r+b') as f:
+            f.write(b'corrupt')
+        cache.get(self.napi, 'v4', 'live.parquet', 300)
+        self.assertEqual(len(self.napi.downloads), 2)
+
+    def test_truncated_download_is_not_cached(self):
+        cache = DatasetCache(self.tmp_dir.name, max_bytes=1000)
+        self.napi.truncate = 10
+        with self.assertRaises(IOError):
+            cache.get(self.napi, 'v4', 'live.parquet', 300)
+        self.assertEqual(cache.load_manifest(), {})
+        self.napi.truncate = 0
+        path = cache.get(self.napi, 'v4', 'live.parquet', 300)
+        self.assertEqual(os.path.getsize(path), 100)
+
+    def test_hash_is_only_computed_when_verifying(self):
+        with mock.patch('dataset_cache.file_sha256') as file_sha256:
+            cache = DatasetCache(self.tmp_dir.name, max_bytes=1000)
+            cache.get(self.napi, 'v4', 'live.parquet', 300)
+            cache.get(self.napi, 'v4', 'live.parquet', 300)
+            file_sha256.assert_not_called()
+        self.assertIsNone(cache.load_manifest()['v4/live.parquet@300']['sha256'])
+
+    def test_dataset_url_query_matches_numerapi(self):
+        import numerapi
+        napi = numerapi.NumerAPI()
+        with mock.patch.object(napi, 'raw_query', return_value={'data': {'dataset': 'url'}}) as raw_query, \
+                mock.patch('numerapi.utils.download_file'):
+            napi.download_dataset('v4/live.parquet', os.path.join(self.tmp_dir.name, 'live.parquet'), round_num=300)
+        query, variables = raw_query.call_args.args
+        self.assertEqual(query.split(), dataset_cache.DATASET_URL_QUERY.split())
+        self.assertEqual(variables, {'filename': 'v4/live.parquet', 'round': 300})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DatasetCache(self.tmp_dir.name, max_bytes=250)
+        live_path = cache.get(self.napi, 'v4', 'live.parquet', 300)
+        validation_path = cache.get(self.napi, 'v4', 'validation.parquet', 300)
+        cache.get(self.napi, 'v4', 'live.parquet', 300)
+        cache.get(self.napi, 'v3', 'numerai_live_data.parquet', 300)
+        self.assertTrue(os.path.exists(live_path))
+        self.assertFalse(os.path.exists(validation_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
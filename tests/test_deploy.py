@@ -1,7 +1,17 @@
+import contextlib
+import io
 import os
+import tempfile
 import unittest
 import warnings
-from ncl.deploy import deploy
+from unittest import mock
+import json
+from botocore.exceptions import ClientError
+from ncl.deploy import deploy, deploy_many, get_build_files, get_image_tag, settings_differ, \
+    maybe_create_policy_and_attach_role, maybe_build_container, maybe_create_codebuild_role, CODEBUILD_ZIP_PREFIX, \
+    HANDLER_FILES, OPTIONAL_HANDLER_FILES
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 class TestDeploy(unittest.TestCase):
@@ -21,5 +31,217 @@ class TestDeploy(unittest.TestCase):
         deploy('', '', model_id, model_name)
 
 
+class TestImageTag(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.build_dir = os.path.join(self.tmp_dir.name, 'build')
+        self.handler_dir = os.path.join(self.tmp_dir.name, 'handler')
+        os.makedirs(self.build_dir)
+        os.makedirs(os.path.join(self.handler_dir, 'ncl'))
+        self.required_files = [name for name in HANDLER_FILES if name not in OPTIONAL_HANDLER_FILES]
+        for name in self.required_files + ['model.pkl']:
+            self.write(name, name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.handler_dir, name), 'w') as f:
+            f.write(content)
+
+    def build_files(self, dockerfile='FROM python'):
+        def urlretrieve(url, path):
+            with open(path, 'w') as f:
+                f.write(dockerfile if path.endswith('Dockerfile') else url)
+        with mock.patch('urllib.request.urlretrieve', urlretrieve):
+            return get_build_files(self.build_dir, self.handler_dir)
+
+    def test_build_files(self):
+        # stale copies in subdirectories must not end up in the bundle
+        os.makedirs(os.path.join(self.handler_dir, 'codebuild_files'))
+        self.write(os.path.join('codebuild_files', 'lambda_handler.py'), 'stale')
+        build_files = self.build_files()
+        self.assertEqual([name for _, name in build_files],
+                         ['Dockerfile', 'buildspec.yml', 'entry.sh'] + self.required_files)
+        self.assertEqual(build_files[4][0], os.path.join(self.handler_dir, 'lambda_handler.py'))
+
+        self.write('custom_pipeline.py', 'custom')
+        self.assertEqual(self.build_files()[-1][1], 'custom_pipeline.py')
+
+    def test_missing_handler_file_raises(self):
+        os.remove(os.path.join(self.handler_dir, 'batch_reader.py'))
+        with self.assertRaisesRegex(FileNotFoundError, 'batch_reader.py'):
+            self.build_files()
+
+    def test_handler_files_match_the_dockerfile(self):
+        copied = set()
+        with open(os.path.join(REPO_DIR, 'Dockerfile')) as f:
+            for line in f:
+                words = line.split()
+                if words[:1] == ['COPY'] and not words[1].startswith('--'):
+                    # the last word is the destination, a trailing * marks an optional file
+                    copied.update(source.rstrip('*') for source in words[1:-1])
+        self.assertEqual(copied - {'entry.sh'}, set(HANDLER_FILES))
+
+    @mock.patch('ncl.deploy.logs_for_build', return_value={'buildStatus': 'FAILED'})
+    @mock.patch('ncl.deploy.start_build', return_value='build:1')
+    def test_failed_build_raises(self, _, __):
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(RuntimeError, 'FAILED'):
+                maybe_build_container('repo', 'project', image_tag='build-abc')
+
+    def test_tag_only_changes_with_build_inputs(self):
+        tag = get_image_tag(self.build_files())
+        self.assertEqual(get_image_tag(self.build_files()), tag)
+
+        self.write('model.pkl', 'a new model')
+        self.assertEqual(get_image_tag(self.build_files()), tag)
+
+        self.assertNotEqual(get_image_tag(self.build_files(dockerfile='FROM python:3.10')), tag)
+        self.write('requirements.txt', 'pandas')
+        self.assertNotEqual(get_image_tag(self.build_files()), tag)
+
+
+@contextlib.contextmanager
+def patch_provisioning(image_exists, get_client=None, **extra_patches):
+    """Patch every provisioning step of ncl.deploy.run_deploy_steps, yields the patches by name."""
+    patches = {
+        'maybe_create_bucket': mock.Mock(return_value='bucket'),
+        'maybe_create_ecr_repo': mock.Mock(return_value={'repositoryName': 'repo', 'repositoryUri': 'uri'}),
+        'get_build_files': mock.Mock(return_value=[]),
+        'get_image_tag': mock.Mock(return_value='build-abc'),
+        'image_exists': mock.Mock(return_value=image_exists),
+        'maybe_create_codebuild_role': mock.Mock(return_value={'Arn': 'codebuild-role'}),
+        'maybe_create_zip_file': mock.Mock(return_value='bundle.zip'),
+        'maybe_create_codebuild_project': mock.Mock(return_value='project'),
+        'maybe_build_container': mock.Mock(),
+        'maybe_create_lambda_role': mock.Mock(return_value={'Arn': 'lambda-role'}),
+        **extra_patches,
+    }
+    with contextlib.ExitStack() as stack:
+        for name, patch in patches.items():
+            stack.enter_context(mock.patch(f'ncl.deploy.{name}', patch))
+        stack.enter_context(mock.patch('ncl.aws_clients.get_account_id', return_value='123'))
+        stack.enter_context(mock.patch('ncl.aws_clients.get_client', get_client or mock.Mock()))
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        yield patches
+
+
+class TestDeployMany(unittest.TestCase):
+
+    def test_builds_once_and_reports_each_model(self):
+        lambda_client = mock.Mock()
+        lambda_client.create_function.side_effect = lambda FunctionName, **kwargs: {'FunctionName': FunctionName}
+        s3 = mock.Mock()
+        s3.upload_file.side_effect = lambda path, bucket, key: self.fail_upload(path)
+        get_client = mock.Mock(side_effect=lambda service: {'lambda': lambda_client, 's3': s3}[service])
+
+        with patch_provisioning(image_exists=False, get_client=get_client) as patches:
+            results = deploy_many([
+                {'model_id': 'id-a', 'model_name': 'a', 'artifact_paths': ['/models/a/model.txt']},
+                {'model_id': 'id-b', 'model_name': 'b', 'artifact_paths': ['/models/b/model.txt']},
+                {'model_id': 'id-c', 'model_name': 'c'},
+            ])
+
+        patches['maybe_build_container'].assert_called_once()
+        patches['maybe_create_lambda_role'].assert_called_once()
+        self.assertEqual(results['id-a'], {'status': 'deployed', 'function_name': 'numerai-compute-a-submit'})
+        self.assertEqual(results['id-b'], {'status': 'error', 'error': 'upload failed'})
+        self.assertEqual(results['id-c'], {'status': 'deployed', 'function_name': 'numerai-compute-c-submit'})
+        s3.upload_file.assert_any_call('/models/a/model.txt', 'bucket', 'id-a/model.txt')
+        for call in lambda_client.create_function.call_args_list:
+            self.assertEqual(call.kwargs['Code'], {'ImageUri': 'uri:build-abc'})
+            self.assertEqual(call.kwargs['Role'], 'lambda-role')
+
+    def fail_upload(self, path):
+        if '/b/' in path:
+            raise IOError('upload failed')
+
+
+class TestDeployGraph(unittest.TestCase):
+
+    def deploy(self, image_exists):
+        with patch_provisioning(image_exists, create_or_update_lambda_function=mock.Mock()) as patches:
+            deploy('', '', 'model-id', 'model')
+        return patches
+
+    def test_new_image_is_built_before_the_function_update(self):
+        patches = self.deploy(image_exists=False)
+        patches['maybe_create_zip_file'].assert_called_once_with('model-id', 'bucket', [])
+        patches['maybe_create_codebuild_project'].assert_called_once_with(
+            '123', 'bucket', 'bundle.zip', 'repo', {'Arn': 'codebuild-role'})
+        patches['maybe_build_container'].assert_called_once_with('repo', 'project', log=True, image_tag='build-abc')
+        self.assertEqual(patches['create_or_update_lambda_function'].call_args.args[2:],
+                         ({'repositoryName': 'repo', 'repositoryUri': 'uri'}, {'Arn': 'lambda-role'}, 'build-abc'))
+
+    def test_existing_image_skips_the_build_steps(self):
+        patches = self.deploy(image_exists=True)
+        for name in ['maybe_create_codebuild_role', 'maybe_create_zip_file', 'maybe_create_codebuild_project',
+                     'maybe_build_container']:
+            patches[name].assert_not_called()
+        patches['create_or_update_lambda_function'].assert_called_once()
+
+
+class TestReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.document = {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': ['s3:GetObject']}]}
+        self.iam = mock.Mock()
+        self.iam.get_policy.return_value = {'Policy': {'DefaultVersionId': 'v2'}}
+        self.iam.get_policy_version.return_value = {'PolicyVersion': {'Document': self.document}}
+        self.iam.list_attached_role_policies.return_value = {'AttachedPolicies': [
+            {'PolicyArn': 'arn:aws:iam::123:policy/policy'}]}
+        self.role = {'RoleName': 'role'}
+
+    def reconcile(self, document):
+        with mock.patch('ncl.aws_clients.get_client', return_value=self.iam):
+            maybe_create_policy_and_attach_role('policy', json.dumps(document, indent=4), '123', self.role)
+
+    def test_settings_differ_ignores_extra_current_settings(self):
+        desired = {'environment': {'image': 'a', 'environmentVariables': [{'name': 'X', 'value': '1'}]}}
+        current = {'arn': 'arn', 'environment': {'image': 'a', 'imagePullCredentialsType': 'CODEBUILD',
+                                                 'environmentVariables': [{'name': 'X', 'value': '1', 'type': 'PLAINTEXT'}]}}
+        self.assertFalse(settings_differ(desired, current))
+        current['environment']['environmentVariables'][0]['value'] = '2'
+        self.assertTrue(settings_differ(desired, current))
+        self.assertTrue(settings_differ({'cache': {'type': 'LOCAL'}}, {}))
+
+    def test_unchanged_policy_is_only_read(self):
+        self.reconcile(self.document)
+        self.iam.create_policy.assert_not_called()
+        self.iam.create_policy_version.assert_not_called()
+        self.iam.attach_role_policy.assert_not_called()
+
+    def test_changed_policy_gets_a_new_version(self):
+        self.iam.list_policy_versions.return_value = {'Versions': [
+            {'VersionId': f'v{i}', 'IsDefaultVersion': i == 2, 'CreateDate': i} for i in range(5)]}
+        self.iam.list_attached_role_policies.return_value = {'AttachedPolicies': []}
+        changed = dict(self.document, Statement=[{'Effect': 'Allow', 'Action': ['s3:PutObject']}])
+        self.reconcile(changed)
+        self.iam.delete_policy_version.assert_called_once_with(PolicyArn='arn:aws:iam::123:policy/policy', VersionId='v0')
+        self.assertEqual(json.loads(self.iam.create_policy_version.call_args.kwargs['PolicyDocument']), changed)
+        self.iam.attach_role_policy.assert_called_once()
+
+    def test_missing_policy_is_created(self):
+        self.iam.get_policy.side_effect = ClientError({'Error': {'Code': 'NoSuchEntity'}}, 'GetPolicy')
+        self.reconcile(self.document)
+        self.iam.create_policy.assert_called_once()
+        self.iam.create_policy_version.assert_not_called()
+
+    @mock.patch('ncl.deploy.create_or_get_role', return_value={'RoleName': 'codebuild-role'})
+    @mock.patch('ncl.deploy.maybe_create_policy_and_attach_role')
+    def test_codebuild_role_can_read_every_bundle(self, attach, _):
+        maybe_create_codebuild_role('123', 'repo', 'numerai-compute-123')
+        document = json.loads(attach.call_args.args[1])
+        resources = [resource for statement in document['Statement']
+                     for resource in ([statement['Resource']] if isinstance(statement['Resource'], str)
+                                      else statement['Resource'])]
+        self.assertIn(f'arn:aws:s3:::numerai-compute-123/{CODEBUILD_ZIP_PREFIX}*.zip', resources)
+        self.assertIn('arn:aws:s3:::numerai-compute-123', resources)
+        # every arn is in the deploying account, s3 arns have no account field
+        self.assertEqual({resource.split(':')[4] for resource in resources if resource.startswith('arn:')}, {'', '123'})
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from ncl import aws_clients
+import batch_reader
+import lambda_handler
+from dataset_cache import DatasetCache
+from model_pipeline import DefaultPipeline, EnsembleModel
+
+
+class ConstantModel:
+
+    def __init__(self, value):
+        self.value = value
+
+    def predict(self, data):
+        return np.full(len(data), self.value)
+
+
+class ColumnModel:
+    """Predicts the value of one feature."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def predict(self, data):
+        return data[self.column].to_numpy(dtype=np.float64)
+
+
+class FailingModel:
+
+    def predict(self, data):
+        raise RuntimeError('model failed')
+
+
+class LocalS3:
+    """head_object, get_object and download_file backed by a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def head_object(self, Bucket, Key):
+        if not os.path.exists(self.path(Bucket, Key)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        stat = os.stat(self.path(Bucket, Key))
+        return {'ETag': f'"{stat.st_mtime_ns}-{stat.st_size}"', 'ContentLength': stat.st_size}
+
+    def get_object(self, Bucket, Key):
+        head = self.head_object(Bucket, Key)
+        with open(self.path(Bucket, Key), 'rb') as f:
+            return dict(head, Body=io.BytesIO(f.read()))
+
+    def download_file(self, Bucket, Key, Filename):
+        self.head_object(Bucket, Key)
+        shutil.copyfile(self.path(Bucket, Key), Filename)
+
+
+class LocalResponse:
+    """A streamed requests response serving a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.headers = {'content-length': str(os.path.getsize(path))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+
+class LocalNumerAPI:
+    """Serves datasets from a local directory and records dataset lookups and lambda statuses."""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.dataset_queries = []
+        self.statuses = {}
+
+    def get_current_round(self):
+        return 300
+
+    def raw_query(self, query, variables=None, authorization=False):
+        if 'dataset(' in query:
+            self.dataset_queries.append(variables)
+            return {'data': {'dataset': os.path.join(self.data_dir, variables['filename'])}}
+        for name, model_id in variables.items():
+            if name.startswith('model_id_'):
+                self.statuses[model_id] = variables[name.replace('model_id_', 'status_')]
+        return {'data': {}}
+
+
+class LocalSession:
+
+    def __init__(self, root):
+        self.clients = {
+            's3': LocalS3(root),
+            'secretsmanager': mock.Mock(get_secret_value=mock.Mock(return_value={
+                'SecretString': json.dumps({'public_id': 'local', 'secret_key': 'local'})})),
+        }
+
+    def client(self, service_name, config=None):
+        if service_name == 'sts':
+            return type('Sts', (), {'get_caller_identity': lambda self: {'Account': '123'}})()
+        return self.clients[service_name]
+
+
+class HandlerTestCase(unittest.TestCase):
+    """Runs the handler against a local S3 bucket that upload_model puts models in."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model_ids = []
+        aws_clients.reset(LocalSession(self.tmp_dir.name))
+        lambda_handler.model_cache.clear()
+
+    def tearDown(self):
+        aws_clients.reset()
+        lambda_handler.model_cache.clear()
+        for model_id in self.model_ids:
+            shutil.rmtree(f'/tmp/models/{model_id}', ignore_errors=True)
+        self.tmp_dir.cleanup()
+
+    def upload_model(self, model, features=('feature_0',)):
+        model_id = f'test-{uuid.uuid4()}'
+        self.model_ids.append(model_id)
+        model_dir = os.path.join(self.tmp_dir.name, 'numerai-compute-123', model_id)
+        os.makedirs(model_dir)
+        orig_dir = os.getcwd()
+        try:
+            os.chdir(model_dir)
+            DefaultPipeline(model_id).pickle(model)
+        finally:
+            os.chdir(orig_dir)
+        with open(os.path.join(model_dir, 'features.json'), 'w') as f:
+            json.dump(list(features), f)
+        return model_id
+
+
+class TestModelCache(HandlerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.model_id = self.upload_model(EnsembleModel([ConstantModel(0.0), ConstantModel(1.0)], [3, 1]))
+        self.model_dir = os.path.join(self.tmp_dir.name, 'numerai-compute-123', self.model_id)
+
+    def test_cache_hit_when_nothing_changed(self):
+        model, _, features = lambda_handler.get_model_wrapper_and_features(self.model_id)
+        cached_model, _, _ = lambda_handler.get_model_wrapper_and_features(self.model_id)
+        self.assertIs(cached_model, model)
+        self.assertEqual(features, ['feature_0'])
+
+    def test_manifest_change_reloads_the_model(self):
+        model, _, _ = lambda_handler.get_model_wrapper_and_features(self.model_id)
+        np.testing.assert_allclose(model.predict(pd.DataFrame({'feature_0': [0]})), [0.25])
+
+        manifest_path = os.path.join(self.model_dir, 'model_manifest.json')
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for member in manifest['members']:
+            member['weight'] = 1.0
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+
+        reloaded, _, _ = lambda_handler.get_model_wrapper_and_features(self.model_id)
+        self.assertIsNot(reloaded, model)
+        np.testing.assert_allclose(reloaded.predict(pd.DataFrame({'feature_0': [0]})), [0.5])
+
+    def load_invocation(self, model_ids):
+        """Load model_ids the way one invocation does and return the loaded models."""
+        lambda_handler.model_cache_generation += 1
+        return [lambda_handler.get_model_wrapper_and_features(model_id)[0] for model_id in model_ids]
+
+    def test_least_recently_used_models_are_evicted(self):
+        other_ids = [self.upload_model(ConstantModel(i)) for i in range(2)]
+        self.load_invocation([other_ids[0]])
+        model_bytes = lambda_handler.model_cache[other_ids[0]]['bytes']
+        with mock.patch('lambda_handler.get_model_cache_budget', return_value=2 * model_bytes):
+            self.load_invocation([other_ids[1]])
+            # using the first model again makes the second one the least recently used
+            self.load_invocation([other_ids[0]])
+            self.load_invocation([self.upload_model(ConstantModel(2))])
+        self.assertEqual(list(lambda_handler.model_cache), [other_ids[0], self.model_ids[-1]])
+
+    def test_more_models_than_fit_keep_the_cached_ones(self):
+        model_ids = [self.upload_model(ConstantModel(i)) for i in range(3)]
+        self.load_invocation(model_ids[:1])
+        model_bytes = lambda_handler.model_cache[model_ids[0]]['bytes']
+        lambda_handler.model_cache.clear()
+
+        with mock.patch('lambda_handler.get_model_cache_budget', return_value=2 * model_bytes):
+            first = self.load_invocation(model_ids)
+            second = self.load_invocation(model_ids)
+        # the third model doesn't evict the first two, so they hit on every invocation
+        self.assertEqual(list(lambda_handler.model_cache), model_ids[:2])
+        self.assertIs(second[0], first[0])
+        self.assertIs(second[1], first[1])
+        self.assertIsNot(second[2], first[2])
+
+    def test_model_over_the_budget_is_not_cached(self):
+        with mock.patch('lambda_handler.get_model_cache_budget', return_value=1):
+            self.load_invocation([self.model_id])
+        self.assertEqual(len(lambda_handler.model_cache), 0)
+
+
+class TestPostPredictMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'validation.parquet')
+        self.features = [f'feature_{i}' for i in range(20)]
+        data = pd.DataFrame(np.random.randint(0, 5, (1000, 20)).astype('int8'), columns=self.features)
+        data['era'] = [f'era{i // 100}' for i in range(1000)]
+        data.to_parquet(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_neutralize_over_the_budget_fails_with_a_clear_error(self):
+        columns = ['era'] + self.features
+        with self.assertRaisesRegex(ValueError, '20 neutralization features'):
+            lambda_handler.check_post_predict_memory(self.path, columns, memory_budget=10000)
+        lambda_handler.check_post_predict_memory(self.path, columns, memory_budget=10 * 1024 * 1024)
+
+    def test_no_post_predict_columns_needs_no_memory(self):
+        lambda_handler.check_post_predict_memory(self.path, [], memory_budget=0)
+
+
+class TestRun(HandlerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = os.path.join(self.tmp_dir.name, 'datasets')
+        self.napi = LocalNumerAPI(self.data_dir)
+        self.uploads = {}
+        self.context = mock.Mock(function_name='numerai-compute', aws_request_id='request', log_stream_name='log')
+        for patcher in [
+            mock.patch.object(lambda_handler, 'numerapi', mock.Mock(NumerAPI=lambda **kwargs: self.napi)),
+            mock.patch.object(lambda_handler, 'secret', None),
+            mock.patch.object(lambda_handler, 'dataset_cache', DatasetCache(os.path.join(self.tmp_dir.name, 'cache'))),
+            mock.patch('dataset_cache.requests.get', side_effect=lambda url, **kwargs: LocalResponse(url)),
+            mock.patch('prediction_writer.upload_buffer', side_effect=self.upload_buffer),
+            mock.patch('lambda_handler.read_data', wraps=lambda_handler.read_data),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload_buffer(self, napi, buffer, filename, model_id, diagnostics=False):
+        self.uploads[model_id] = (filename, pd.read_csv(io.BytesIO(buffer.to_pybytes())))
+        return f'upload-{model_id}'
+
+    def write_dataset(self, path, data):
+        path = os.path.join(self.data_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data.to_parquet(path)
+
+    def live_data(self, num_rows=100):
+        return pd.DataFrame({
+            'era': 'X',
+            'feature_0': np.arange(num_rows, dtype=np.int8),
+            'feature_1': np.arange(num_rows, 0, -1).astype(np.int8),
+            'feature_2': np.zeros(num_rows, dtype=np.int8),
+        }, index=pd.Index([f'n{i}' for i in range(num_rows)], name='id'))
+
+    def test_models_share_one_live_data_load_and_fail_separately(self):
+        live = self.live_data()
+        self.write_dataset('v4/live.parquet', live)
+        good_id = self.upload_model(ColumnModel('feature_0'), features=['feature_0'])
+        failing_id = self.upload_model(FailingModel(), features=['feature_1'])
+        other_id = self.upload_model(ColumnModel('feature_1'), features=['feature_1'])
+
+        succeeded = lambda_handler.run({'model_ids': [good_id, failing_id, other_id]}, self.context)
+
+        self.assertFalse(succeeded)
+        self.assertEqual(self.napi.dataset_queries, [{'filename': 'v4/live.parquet', 'round': 300}])
+        # one read for the union of the models' feature columns
+        lambda_handler.read_data.assert_called_once_with(mock.ANY, features=['feature_0', 'feature_1'])
+        self.assertEqual(self.napi.statuses, {good_id: 'complete', failing_id: 'error', other_id: 'complete'})
+        self.assertEqual(sorted(self.uploads), sorted([good_id, other_id]))
+        filename, predictions = self.uploads[good_id]
+        self.assertEqual(filename, 'live_predictions_300.csv')
+        self.assertEqual(list(predictions['id']), list(live.index))
+        np.testing.assert_allclose(predictions['prediction'], live['feature_0'].rank(pct=True))
+        _, other_predictions = self.uploads[other_id]
+        np.testing.assert_allclose(other_predictions['prediction'], live['feature_1'].rank(pct=True))
+
+    def test_v2_predictions_use_the_id_column(self):
+        live = self.live_data().reset_index()
+        self.write_dataset('v2/numerai_live_data.parquet', live)
+        model_id = self.upload_model(ColumnModel('feature_0'), features=['feature_0'])
+
+        self.assertTrue(lambda_handler.run({'model_id': model_id, 'data_version': 'v2'}, self.context))
+
+        _, predictions = self.uploads[model_id]
+        self.assertEqual(list(predictions['id']), list(live['id']))
+        self.assertEqual(self.napi.statuses, {model_id: 'complete'})
+
+    def test_diagnostics_rank_across_the_whole_file(self):
+        num_rows = 3000
+        validation = pd.DataFrame({
+            'era': [f'era{i // 500}' for i in range(num_rows)],
+            'feature_0': np.random.default_rng(0).integers(0, 100, num_rows).astype(np.int8),
+        }, index=pd.Index([f'n{i}' for i in range(num_rows)], name='id'))
+        path = os.path.join(self.data_dir, 'v4/validation.parquet')
+        os.makedirs(os.path.dirname(path))
+        validation.to_parquet(path, row_group_size=1000)
+        model_id = self.upload_model(ColumnModel('feature_0'), features=['feature_0'])
+
+        # a tiny memory budget makes prefetch_batches read the file in several batches,
+        # ranking each of them separately would not match the ranks over the whole file
+        with mock.patch('batch_reader.get_memory_budget', return_value=1):
+            self.assertGreater(len(list(batch_reader.prefetch_batches(path, columns=['feature_0']))), 1)
+            self.assertTrue(lambda_handler.run(
+                {'model_id': model_id, 'invocation_type': 'diagnostics'}, self.context))
+
+        filename, predictions = self.uploads[model_id]
+        self.assertEqual(filename, 'validation_predictions.csv')
+        self.assertEqual(list(predictions['id']), list(validation.index))
+        np.testing.assert_allclose(predictions['prediction'], validation['feature_0'].rank(pct=True))
@@ -0,0 +1,33 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_span_emits_embedded_metric_record(self):
+        with tempfile.TemporaryDirectory() as td:
+            file_path = os.path.join(td, 'metrics.jsonl')
+            stream = io.StringIO()
+            metrics = Metrics(dimensions={'FunctionName': 'test'}, file_path=file_path, stream=stream)
+            with metrics.span('outer', model_id='a'):
+                with metrics.span('inner'):
+                    pass
+
+            records = [json.loads(line) for line in stream.getvalue().splitlines()]
+            with open(file_path) as f:
+                self.assertEqual([json.loads(line) for line in f], records)
+
+        self.assertEqual([r['Stage'] for r in records], ['inner', 'outer'])
+        outer = records[1]
+        self.assertEqual(outer['model_id'], 'a')
+        self.assertEqual(outer['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['FunctionName', 'Stage']])
+        self.assertGreaterEqual(outer['Duration'], records[0]['Duration'])
+        self.assertGreaterEqual(outer['PeakRSS'], records[0]['PeakRSS'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from model_pipeline import DefaultPipeline, EnsembleModel, LIGHTGBM_FORMAT, JOBLIB_FORMAT, PICKLE_FORMAT, ENSEMBLE_FORMAT
+
+
+class ConstantModel:
+
+    def predict(self, data):
+        return np.full(len(data), 0.5)
+
+
+class TestDefaultPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+        self.data = pd.DataFrame(rng.random((200, 5)), columns=[f'feature_{i}' for i in range(5)])
+        self.target = rng.random(200)
+        self.pipeline = DefaultPipeline('model-id')
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        self.tmp_dir.cleanup()
+
+    def assert_round_trip(self, model, expected_format):
+        self.pipeline.pickle(model)
+        self.assertEqual(self.pipeline.read_manifest('.')['format'], expected_format)
+        loaded = self.pipeline.unpickle('.')
+        np.testing.assert_allclose(loaded.predict(self.data), model.predict(self.data))
+
+    def test_lightgbm_regressor_uses_native_format(self):
+        import lightgbm as lgb
+        model = lgb.LGBMRegressor(n_estimators=5, verbose=-1).fit(self.data, self.target)
+        self.assert_round_trip(model, LIGHTGBM_FORMAT)
+
+    def test_sklearn_model_uses_joblib(self):
+        from sklearn.linear_model import Ridge
+        self.assert_round_trip(Ridge().fit(self.data, self.target), JOBLIB_FORMAT)
+
+    def test_other_models_are_pickled(self):
+        self.assert_round_trip(ConstantModel(), PICKLE_FORMAT)
+
+    def test_ensemble_members_keep_their_formats(self):
+        import lightgbm as lgb
+        from sklearn.linear_model import Ridge
+        members = [lgb.LGBMRegressor(n_estimators=5, verbose=-1).fit(self.data, self.target),
+                   Ridge().fit(self.data, self.target),
+                   ConstantModel()]
+        ensemble = EnsembleModel(members, [2, 1, 1])
+        self.assert_round_trip(ensemble, ENSEMBLE_FORMAT)
+
+        manifest = self.pipeline.read_manifest('.')
+        self.assertEqual([m['format'] for m in manifest['members']], [LIGHTGBM_FORMAT, JOBLIB_FORMAT, PICKLE_FORMAT])
+        self.assertEqual(self.pipeline.model_artifact_paths('.'), [m['path'] for m in manifest['members']])
+
+    def test_ensemble_predictions_are_the_weighted_blend(self):
+        from sklearn.linear_model import Ridge
+        ridge = Ridge().fit(self.data, self.target)
+        expected = (3 * ridge.predict(self.data) + 0.5) / 4
+        np.testing.assert_allclose(EnsembleModel([ridge, ConstantModel()], [3, 1]).predict(self.data), expected)
+
+    def test_models_without_manifest_are_read_as_pickles(self):
+        pd.to_pickle(ConstantModel(), 'model.pkl')
+        self.assertEqual(self.pipeline.read_manifest('.'), {'format': PICKLE_FORMAT, 'path': 'model.pkl'})
+        self.assertIsInstance(self.pipeline.unpickle('.'), ConstantModel)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+import pandas as pd
+from postprocessing import apply_steps, gaussianize, neutralize, rank_per_era, get_step_columns
+
+
+class TestPostprocessing(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        num_rows = 600
+        self.features = [f'feature_{i}' for i in range(4)]
+        self.data = pd.DataFrame(rng.integers(0, 5, (num_rows, 4)).astype(np.int8), columns=self.features)
+        self.data['era'] = np.repeat(['0001', '0002', '0003'], num_rows // 3)
+        self.data.index = pd.Index([f'n{i}' for i in range(num_rows)], name='id')
+        self.predictions = pd.Series(
+            self.data[self.features].to_numpy() @ [0.5, -0.2, 0.1, 0.0] + rng.random(num_rows),
+            index=self.data.index,
+            name='preds',
+        )
+
+    def test_rank_per_era_matches_groupby_rank(self):
+        expected = self.predictions.groupby(self.data['era']).rank(pct=True).to_numpy()
+        np.testing.assert_allclose(rank_per_era(self.predictions.to_numpy(), self.data['era']), expected)
+
+    def test_gaussianize_is_standard_normal_within_each_era(self):
+        values = gaussianize(self.predictions.to_numpy(), self.data['era'].to_numpy())
+        for _, era_values in pd.Series(values).groupby(self.data['era'].to_numpy()):
+            self.assertAlmostEqual(era_values.mean(), 0, places=6)
+            self.assertTrue(np.isfinite(era_values).all())
+
+    def test_neutralize_matches_per_era_pinv(self):
+        exposures = self.data[self.features].to_numpy(dtype=np.float64)
+        values = self.predictions.to_numpy()
+        result = neutralize(values, exposures, self.data['era'].to_numpy(), proportion=0.5)
+
+        for era in self.data['era'].unique():
+            mask = (self.data['era'] == era).to_numpy()
+            x, y = exposures[mask], values[mask]
+            expected = y - 0.5 * x @ (np.linalg.pinv(x) @ y)
+            np.testing.assert_allclose(result[mask], expected / expected.std(), rtol=1e-4, atol=1e-4)
+
+    def test_full_neutralization_removes_feature_exposure(self):
+        exposures = self.data[self.features].to_numpy()
+        result = neutralize(self.predictions.to_numpy(), exposures, self.data['era'].to_numpy())
+        for era in self.data['era'].unique():
+            mask = (self.data['era'] == era).to_numpy()
+            np.testing.assert_allclose(exposures[mask].T.astype(np.float64) @ result[mask], 0, atol=1e-2)
+
+    def test_apply_steps_chains_and_keeps_index(self):
+        steps = [('neutralize', {'proportion': 1.0}), ('gaussianize', {}), ('rank_per_era', {})]
+        result = apply_steps(self.predictions, steps, self.data)
+        self.assertTrue(result.index.equals(self.predictions.index))
+        self.assertTrue(((result > 0) & (result <= 1)).all())
+
+    def test_default_rank_step_matches_pandas_rank(self):
+        result = apply_steps(self.predictions, [('rank', {})])
+        pd.testing.assert_series_equal(result, self.predictions.rank(pct=True))
+
+    def test_get_step_columns(self):
+        self.assertEqual(get_step_columns([('rank', {})], self.features), [])
+        self.assertEqual(get_step_columns([('rank_per_era', {})], self.features), ['era'])
+        self.assertEqual(
+            get_step_columns([('neutralize', {'features': ['feature_1']})], self.features),
+            ['era', 'feature_1'],
+        )
+        self.assertEqual(get_step_columns([('neutralize', {})], self.features), ['era'] + self.features)
+
+    def test_unknown_step_raises(self):
+        with self.assertRaises(ValueError):
+            apply_steps(self.predictions, [('sharpen', {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import collections
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numerapi
+import pandas as pd
+import prediction_writer
+
+
+class RecordingNumerAPI(numerapi.NumerAPI):
+    """Records the GraphQL calls made by the upload methods instead of sending them."""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def raw_query(self, query, variables=None, authorization=False, **kwargs):
+        self.queries.append((' '.join(query.split()), variables, authorization))
+        return {'data': collections.defaultdict(
+            lambda: {'filename': 'uploaded.csv', 'url': 'http://localhost/upload', 'id': 'upload-id'})}
+
+
+def record_upload(upload):
+    """Run upload, returning the GraphQL calls and the (url, headers, body) of every PUT."""
+    napi = RecordingNumerAPI()
+    puts = []
+
+    def put(url, data=None, headers=None, **kwargs):
+        puts.append((url, headers or {}, data.read() if hasattr(data, 'read') else data))
+        return mock.Mock(status_code=200)
+
+    with mock.patch('requests.put', side_effect=put), \
+            mock.patch.dict(os.environ, {'NUMERAI_COMPUTE_ID': 'compute', 'TRIGGER_ID': 'trigger'}):
+        result = upload(napi)
+    return result, napi.queries, puts
+
+
+class TestUploadBuffer(unittest.TestCase):
+    """
+    upload_buffer repeats the auth -> put -> create flow of numerapi's upload
+    methods (pinned in requirements.txt) with an in-memory buffer. These tests
+    fail when numerapi changes that flow, e.g. _upload_auth or the mutations.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        predictions = pd.Series([0.25, 0.75], index=pd.Index(['a', 'b'], name='id'))
+        self.buffer = prediction_writer.write_predictions(predictions)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, filename):
+        path = os.path.join(self.tmp_dir.name, filename)
+        with open(path, 'wb') as f:
+            f.write(self.buffer.to_pybytes())
+        return path
+
+    def assert_same_upload(self, ours, public):
+        self.assertEqual(record_upload(ours), record_upload(public))
+
+    def test_matches_upload_predictions(self):
+        path = self.write_file('live_predictions_1.csv')
+        self.assert_same_upload(
+            lambda napi: prediction_writer.upload_buffer(napi, self.buffer, 'live_predictions_1.csv', 'model'),
+            lambda napi: napi.upload_predictions(path, model_id='model'))
+
+    def test_matches_upload_diagnostics(self):
+        path = self.write_file('validation_predictions.csv')
+        self.assert_same_upload(
+            lambda napi: prediction_writer.upload_buffer(
+                napi, self.buffer, 'validation_predictions.csv', 'model', diagnostics=True),
+            lambda napi: napi.upload_diagnostics(path, model_id='model'))
+
+    def test_upload_auth_is_unchanged(self):
+        # upload_buffer calls this private numerapi method directly
+        napi = RecordingNumerAPI()
+        auth = napi._upload_auth('submission_upload_auth', '/tmp/live_predictions_1.csv', 8, 'model')
+        self.assertEqual(auth, {'filename': 'uploaded.csv', 'url': 'http://localhost/upload', 'id': 'upload-id'})
+        self.assertEqual(napi.queries, [(
+            'query($filename: String! $tournament: Int! $modelId: String) { '
+            'submission_upload_auth(filename: $filename tournament: $tournament modelId: $modelId) { '
+            'filename url } }',
+            {'filename': 'live_predictions_1.csv', 'tournament': 8, 'modelId': 'model'},
+            True)])
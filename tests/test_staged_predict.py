@@ -0,0 +1,90 @@
+import threading
+import unittest
+import numpy as np
+import pandas as pd
+from model_pipeline import DefaultPipeline
+from staged_predict import chunk_frame, predict_in_stages
+
+
+class SumModel:
+
+    def predict(self, data):
+        return data.sum(axis=1).to_numpy()
+
+
+class RecordingModel(SumModel):
+
+    def __init__(self):
+        self.frames = []
+
+    def predict(self, data):
+        self.frames.append(data)
+        return super().predict(data)
+
+
+class DoublingPipeline(DefaultPipeline):
+
+    def __init__(self, model_id):
+        super().__init__(model_id)
+        self.threads = set()
+
+    def pre_predict(self, data):
+        self.threads.add(threading.current_thread().name)
+        return data * 2
+
+
+class InPlacePipeline(DefaultPipeline):
+
+    def pre_predict(self, data):
+        data.loc[:, 'feature_0'] = 0
+
+
+class TestStagedPredict(unittest.TestCase):
+
+    def setUp(self):
+        self.features = ['feature_0', 'feature_1']
+        self.data = pd.DataFrame(
+            np.arange(2000).reshape(1000, 2),
+            columns=self.features,
+            index=pd.Index([f'n{i}' for i in range(1000)], name='id'),
+        )
+
+    def run_stages(self, pipeline, **kwargs):
+        chunks = chunk_frame(self.data, chunk_rows=64)
+        results = list(predict_in_stages(SumModel(), pipeline, chunks, self.features, **kwargs))
+        index = np.concatenate([index for index, _ in results])
+        predictions = np.concatenate([predictions for _, predictions in results])
+        return index, predictions
+
+    def test_results_keep_chunk_order(self):
+        index, predictions = self.run_stages(DefaultPipeline('model'), pre_predict_workers=3, max_chunks_in_flight=4)
+        np.testing.assert_array_equal(index, self.data.index)
+        np.testing.assert_array_equal(predictions, self.data.sum(axis=1))
+
+    def test_pre_predict_runs_on_its_own_executor(self):
+        pipeline = DoublingPipeline('model')
+        _, predictions = self.run_stages(pipeline)
+        np.testing.assert_array_equal(predictions, self.data.sum(axis=1) * 2)
+        self.assertTrue(all(name.startswith('pre-predict') for name in pipeline.threads))
+
+    def test_pre_predict_returning_none_keeps_edited_chunk(self):
+        _, predictions = self.run_stages(InPlacePipeline('model'))
+        np.testing.assert_array_equal(predictions, self.data['feature_1'])
+
+    def test_chunks_with_exactly_the_features_are_not_copied(self):
+        chunks = list(chunk_frame(self.data, chunk_rows=500))
+        model = RecordingModel()
+        list(predict_in_stages(model, DefaultPipeline('model'), iter(chunks), self.features))
+        self.assertEqual([frame is chunk for frame, chunk in zip(model.frames, chunks)], [True, True])
+
+    def test_other_columns_are_dropped_before_predict(self):
+        data = self.data.assign(era='era1')
+        model = RecordingModel()
+        results = list(predict_in_stages(model, DefaultPipeline('model'), chunk_frame(data, chunk_rows=500),
+                                         self.features))
+        self.assertEqual([list(frame.columns) for frame in model.frames], [self.features] * 2)
+        np.testing.assert_array_equal(np.concatenate([p for _, p in results]), self.data.sum(axis=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import unittest
+from status_reporter import StatusReporter, build_status_mutation
+
+
+class FakeNumerAPI:
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.queries = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def raw_query(self, query, variables=None, authorization=False):
+        self.release.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            raise ValueError('server error')
+        self.queries.append(variables)
+        return {'data': {}}
+
+
+def sent_statuses(variables):
+    statuses = {}
+    i = 0
+    while f'model_id_{i}' in variables:
+        statuses[variables[f'model_id_{i}']] = variables[f'status_{i}']
+        i += 1
+    return statuses
+
+
+class TestStatusReporter(unittest.TestCase):
+
+    def test_build_status_mutation_aliases_each_model(self):
+        query, variables = build_status_mutation({'a': 'complete', 'b': 'error'})
+        self.assertIn('status_0: modelLambdaStatus', query)
+        self.assertIn('status_1: modelLambdaStatus', query)
+        self.assertEqual(sent_statuses(variables), {'a': 'complete', 'b': 'error'})
+
+    def test_pending_transitions_are_coalesced_into_one_batch(self):
+        napi = FakeNumerAPI()
+        napi.release.clear()
+        reporter = StatusReporter(napi, 'function', 'request')
+        reporter.set_status('first', 'in_progress')
+        # hold the first mutation in flight while the others queue up
+        while not reporter.sending:
+            pass
+        reporter.set_status('a', 'in_progress')
+        reporter.set_status('b', 'in_progress')
+        reporter.set_status('a', 'complete')
+        reporter.set_status('b', 'error')
+        reporter.set_status('b', 'in_progress')
+        napi.release.set()
+        reporter.close(timeout=5)
+
+        self.assertEqual(len(napi.queries), 2)
+        self.assertEqual(sent_statuses(napi.queries[1]), {'a': 'complete', 'b': 'error'})
+        self.assertEqual(napi.queries[1]['request_id'], 'request')
+
+    def test_failed_mutations_are_retried(self):
+        napi = FakeNumerAPI(failures=2)
+        reporter = StatusReporter(napi, 'function', 'request', backoff_seconds=0)
+        reporter.set_status('a', 'complete')
+        reporter.close(timeout=5)
+        self.assertEqual([sent_statuses(q) for q in napi.queries], [{'a': 'complete'}])
+
+    def test_gives_up_without_raising(self):
+        napi = FakeNumerAPI(failures=10)
+        reporter = StatusReporter(napi, 'function', 'request', max_attempts=3, backoff_seconds=0)
+        reporter.set_status('a', 'complete')
+        reporter.close(timeout=5)
+        self.assertEqual(napi.queries, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
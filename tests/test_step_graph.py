@@ -0,0 +1,58 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+from ncl.step_graph import run_steps
+
+
+class TestStepGraph(unittest.TestCase):
+
+    def run_quietly(self, steps, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            return run_steps(steps, **kwargs), output.getvalue()
+
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def independent(value):
+            def step(results):
+                # only passes if both steps are running at the same time
+                barrier.wait()
+                return value
+            return step
+
+        results, output = self.run_quietly({
+            'a': ([], independent(1)),
+            'b': ([], independent(2)),
+            'sum': (['a', 'b'], lambda results: results['a'] + results['b']),
+        })
+        self.assertEqual(results, {'a': 1, 'b': 2, 'sum': 3})
+        for name in ['a', 'b', 'sum', 'total']:
+            self.assertIn(name, output)
+
+    def test_failure_stops_dependent_steps(self):
+        ran = []
+
+        def fail(results):
+            raise RuntimeError('step failed')
+
+        def slow(results):
+            time.sleep(0.05)
+            ran.append('slow')
+
+        with self.assertRaisesRegex(RuntimeError, 'step failed'):
+            self.run_quietly({
+                'fail': ([], fail),
+                'slow': ([], slow),
+                'after': (['fail'], lambda results: ran.append('after')),
+            })
+        # running steps finish, steps that depend on the failure never start
+        self.assertEqual(ran, ['slow'])
+
+    def test_invalid_graphs(self):
+        with self.assertRaises(ValueError):
+            self.run_quietly({'a': (['missing'], lambda results: None)})
+        with self.assertRaisesRegex(ValueError, 'circular'):
+            self.run_quietly({'a': (['b'], lambda results: None), 'b': (['a'], lambda results: None)})